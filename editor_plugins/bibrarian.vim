@@ -1,3 +1,7 @@
+" Set to 0 to have every lookup load the bib files itself instead of asking
+" a resident bibrarian daemon.
+let g:bibrarian_daemon = get(g:, 'bibrarian_daemon', 1)
+
 function! FindBibKeys()
     let l:tmpfile = tempname()
     execute "!bibrarian -k " . tmpfile
@@ -8,6 +12,53 @@ function! FindBibKeys()
     endif
 endfunction
 
+" Starts a daemon for the configuration of the current file, unless one
+" already serves it. It outlives vim, so later sessions find it running.
+function! StartBibrarianDaemon()
+    if !g:bibrarian_daemon
+        return
+    endif
+
+    let l:cmd = ['bibrarian', '--daemon']
+    if exists('*jobstart')
+        call jobstart(l:cmd, {'cwd': expand('%:p:h'), 'detach': 1})
+    elseif exists('*job_start')
+        call job_start(l:cmd, {'cwd': expand('%:p:h'), 'stoponexit': '',
+                    \ 'in_io': 'null', 'out_io': 'null', 'err_io': 'null'})
+    endif
+endfunction
+
+" Completes bib keys (CTRL-X CTRL-U) from the entries matching the word
+" before the cursor, e.g. a few letters of a title or an author.
+function! CompleteBibKeys(findstart, base)
+    if a:findstart
+        let l:start = col('.') - 1
+        while l:start > 0 && getline('.')[l:start - 1] !~ '[{,[:space:]]'
+            let l:start -= 1
+        endwhile
+        return l:start
+    endif
+
+    let l:cmd = 'cd ' . shellescape(expand('%:p:h')) .
+                \ ' && bibrarian -q ' . shellescape(a:base) . ' --limit 20'
+    let l:matches = []
+    for l:line in systemlist(l:cmd)
+        try
+            let l:hit = json_decode(l:line)
+        catch
+            continue
+        endtry
+        call add(l:matches, {'word': l:hit.key, 'menu': l:hit.title,
+                    \ 'info': join(l:hit.authors, '; ')})
+    endfor
+    return l:matches
+endfunction
+
 autocmd FileType      tex imap <C-T> <C-O>:call FindBibKeys()<CR>
 autocmd FileType plaintex imap <C-T> <C-O>:call FindBibKeys()<CR>
 
+autocmd FileType      tex setlocal completefunc=CompleteBibKeys
+autocmd FileType plaintex setlocal completefunc=CompleteBibKeys
+
+autocmd FileType      tex call StartBibrarianDaemon()
+autocmd FileType plaintex call StartBibrarianDaemon()
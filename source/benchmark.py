@@ -0,0 +1,547 @@
+"""Benchmarks for loading, searching and writing bib files.
+
+Generates a deterministic synthetic corpus, times the hot paths of main.py
+on it and prints the timings as JSON. To check a change for regressions:
+
+    python3 source/benchmark.py -o before.json
+    (apply the change)
+    python3 source/benchmark.py --compare before.json
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import main
+
+class CorpusGenerator:
+    """Writes a reproducible set of bib files that look like real ones.
+
+    Words, authors and venues are drawn with Zipf-like frequencies, so that
+    a few of them recur a lot, as they do in real bibliographies. Titles and
+    names carry LaTeX escapes and protected words, some venues and months
+    are @string macros, and some entries are duplicated in another file or
+    reappear as preprints under another key.
+    """
+
+    WORDS = (
+        "learning", "neural", "network", "networks", "data", "model", "models", "deep",
+        "graph", "efficient", "system", "systems", "analysis", "towards", "scalable",
+        "optimization", "approach", "training", "distributed", "adaptive", "robust",
+        "transformer", "attention", "memory", "cache", "parallel", "language", "large",
+        "inference", "reinforcement", "representation", "fast", "query", "search",
+        "framework", "performance", "evaluation", "algorithm", "algorithms", "sparse",
+        "online", "dynamic", "semantic", "stochastic", "gradient", "convex", "kernel",
+        "embedding", "compiler", "storage", "database", "index", "retrieval", "privacy",
+        "secure", "verification", "hardware", "accelerator", "energy", "mobile", "cloud",
+        "scheduling", "federated", "generative", "adversarial", "diffusion", "vision",
+        "image", "video", "speech", "recognition", "detection", "segmentation", "policy",
+        "bayesian", "probabilistic", "causal", "temporal", "spatial", "multi-agent",
+        "benchmark", "dataset", "survey", "theory", "bounds", "complexity", "approximate",
+        "randomized", "streaming", "concurrent", "lock-free", "consensus", "replication",
+        "fault-tolerant", "serverless", "quantization", "pruning", "distillation",
+        "contrastive", "self-supervised", "few-shot", "zero-shot", "meta-learning",
+        "interpretable", "fairness", "calibration", "uncertainty", "equivariant",
+        "hyperbolic", "topological", "spectral", "tensor", "polyhedral", "vectorized",
+        "succinct", "persistent", "transactional", "speculative", "heterogeneous",
+    )
+
+    # Words with the LaTeX markup they usually come with in titles.
+    LATEX_WORDS = (
+        "{GPU}", "{GPUs}", "{SQL}", "{LSTM}", "{BERT}", "{RDMA}", "{FPGA}", "{NP}-hard",
+        "na{\\\"\\i}ve", "{\\em in situ}", "$k$-means", "$O(n \\log n)$", "$\\ell_1$",
+        "{B}ayesian", "{M}arkov", "{G}aussian", "{E}uclidean", "{\\'E}tude", "{\\&}",
+        "r{\\'e}sum{\\'e}", "{S}chr{\\\"o}dinger", "--",
+    )
+
+    FIRST_NAMES = (
+        "Wei", "Jing", "Li", "Yu", "Ming", "Anna", "John", "David", "Maria", "Michael",
+        "Sarah", "James", "Emily", "Robert", "Laura", "Daniel", "Sophie", "Thomas",
+        "Elena", "Pierre", "Hiroshi", "Yuki", "Priya", "Arjun", "Olga", "Ivan", "Lucas",
+        "Fran{\\c{c}}ois", "J{\\\"u}rgen", "Ren{\\'e}", "Zo{\\\"e}", "Ana{\\\"\\i}s",
+        "Bj{\\\"o}rn", "S{\\o}ren", "Jos{\\'e}", "Andr{\\'a}s", "A. B.", "J.-P.", "M.",
+    )
+
+    LAST_NAMES = (
+        "Wang", "Zhang", "Li", "Liu", "Chen", "Yang", "Smith", "Johnson", "Brown",
+        "Kumar", "Singh", "Kim", "Park", "Nguyen", "Garcia", "Martin", "Rossi",
+        "Tanaka", "Suzuki", "Ivanov", "Novak", "Cohen", "Levy", "Silva", "Santos",
+        "M{\\\"u}ller", "Sch{\\\"o}lkopf", "Garc{\\'\\i}a", "Dvo{\\v{r}}{\\'a}k",
+        "{\\O}stergaard", "Erd{\\H{o}}s", "Ng", "Le", "O'Brien", "Smith-Jones",
+    )
+
+    PARTICLES = ("von", "van der", "de", "de la", "di")
+
+    CONFERENCES = (
+        ("neurips", "Advances in Neural Information Processing Systems"),
+        ("icml", "Proceedings of the International Conference on Machine Learning"),
+        ("sosp", "Proceedings of the ACM Symposium on Operating Systems Principles"),
+        ("vldb", "Proceedings of the VLDB Endowment"),
+        ("sigmod", "Proceedings of the International Conference on Management of Data"),
+        ("cvpr", "IEEE/CVF Conference on Computer Vision and Pattern Recognition"),
+        ("pldi", "Programming Language Design and Implementation"),
+        ("osdi", "Symposium on Operating Systems Design and Implementation"),
+        ("acl", "Annual Meeting of the Association for Computational Linguistics"),
+        ("isca", "International Symposium on Computer Architecture"),
+    )
+
+    JOURNALS = (
+        "Journal of Machine Learning Research", "Communications of the {ACM}",
+        "{IEEE} Transactions on Pattern Analysis and Machine Intelligence",
+        "{ACM} Computing Surveys", "Nature", "{SIAM} Journal on Computing",
+        "{ACM} Transactions on Computer Systems", "Artificial Intelligence",
+    )
+
+    PUBLISHERS = ("{ACM}", "{IEEE}", "Springer", "MIT Press", "Elsevier", "{USENIX} Association")
+
+    MONTHS = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+
+    # Entry types by frequency, as in a typical CS bibliography.
+    TYPES = (("inproceedings", 50), ("article", 35), ("misc", 5), ("book", 4),
+             ("phdthesis", 3), ("techreport", 3))
+
+    DUPLICATE_RATE = 0.03
+    PREPRINT_RATE = 0.02
+
+    def __init__(self, entries, files, seed=0):
+        self.entries = entries
+        self.files = max(1, files)
+        self.seed = seed
+
+    def Write(self, directory):
+        """Writes the corpus into the directory; returns the paths of its files."""
+        rand = random.Random(self.seed)
+        words = CorpusGenerator._Zipf(CorpusGenerator.WORDS)
+        authors = CorpusGenerator._Zipf([self._Author(rand) for _ in range(max(50, self.entries // 4))])
+        conferences = CorpusGenerator._Zipf(CorpusGenerator.CONFERENCES)
+        journals = CorpusGenerator._Zipf(CorpusGenerator.JOURNALS)
+
+        # Keys are unique across the corpus: a key appears in two files only
+        # for a duplicated entry, which is the same in both.
+        contents = [[] for _ in range(self.files)]
+        keys = set()
+        for i in range(self.entries):
+            f = i * self.files // self.entries
+            fields = self._Fields(rand, words, authors, conferences, journals)
+            key = self._Key(fields, keys)
+            contents[f].append(self._Entry(rand, key, fields))
+
+            if self.files > 1 and rand.random() < CorpusGenerator.DUPLICATE_RATE:
+                other = rand.choice([g for g in range(self.files) if g != f])
+                contents[other].append(contents[f][-1])
+
+            if rand.random() < CorpusGenerator.PREPRINT_RATE:
+                preprint = dict(fields, type='misc', venue=None, publisher=None, pages=None,
+                                eprint=f"{rand.randint(1000, 2499)}.{rand.randint(0, 99999):05}")
+                contents[f].append(self._Entry(rand, self._Key(preprint, keys), preprint))
+
+        paths = []
+        for f, entries in enumerate(contents):
+            path = os.path.join(directory, f"part{f:03}.bib")
+            with open(path, 'w') as out:
+                out.write(f"@comment{{Synthetic corpus {f + 1}/{self.files}, seed {self.seed}}}\n\n")
+                for macro, name in CorpusGenerator.CONFERENCES:
+                    out.write(f'@string{{{macro} = "{name}"}}\n')
+                out.write("\n")
+                out.write("\n".join(entries))
+            paths.append(path)
+
+        return paths
+
+    @staticmethod
+    def _Zipf(items):
+        weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(items))))
+        return lambda rand: rand.choices(items, cum_weights=weights)[0]
+
+    @staticmethod
+    def _Author(rand):
+        first = rand.choice(CorpusGenerator.FIRST_NAMES)
+        last = rand.choice(CorpusGenerator.LAST_NAMES)
+        style = rand.random()
+        if style < 0.05:
+            return f"{{{rand.choice(('Open', 'Deep', 'Applied'))} {last} Research Group}}"
+        elif style < 0.12:
+            return f"{rand.choice(CorpusGenerator.PARTICLES)} {last}, {first}"
+        elif style < 0.15:
+            return f"{last}, Jr., {first}"
+        elif style < 0.6:
+            return f"{last}, {first}"
+        return f"{first} {last}"
+
+    def _Fields(self, rand, words, authors, conferences, journals):
+        title = [words(rand) for _ in range(rand.randint(3, 12))]
+        for _ in range(rand.choice((0, 0, 0, 1, 1, 2))):
+            title.insert(rand.randrange(len(title) + 1), rand.choice(CorpusGenerator.LATEX_WORDS))
+        title[0] = title[0][:1].upper() + title[0][1:]
+
+        people = []
+        for _ in range(min(1 + int(rand.expovariate(0.4)), 30)):
+            author = authors(rand)
+            if author not in people:
+                people.append(author)
+
+        entry_type = rand.choices([t for t, _ in CorpusGenerator.TYPES],
+                                  weights=[w for _, w in CorpusGenerator.TYPES])[0]
+        venue = None
+        if entry_type == 'inproceedings':
+            macro, _ = conferences(rand)
+            venue = ('booktitle', macro)
+        elif entry_type == 'article':
+            venue = ('journal', f"{{{journals(rand)}}}")
+
+        return {
+            'type': entry_type,
+            'title': " ".join(title),
+            'author': " and ".join(people),
+            'year': min(2025, 2026 - int(rand.expovariate(0.15))),
+            'venue': venue,
+            'publisher': rand.choice(CorpusGenerator.PUBLISHERS) if rand.random() < 0.4 else None,
+            'month': rand.choice(CorpusGenerator.MONTHS) if rand.random() < 0.3 else None,
+            'pages': (lambda p: f"{p}--{p + rand.randint(4, 20)}")(rand.randint(1, 900))
+                     if venue is not None else None,
+            'doi': f"10.{rand.randint(1000, 9999)}/{rand.randint(100000, 999999)}"
+                   if rand.random() < 0.5 else None,
+            'eprint': None,
+        }
+
+    @staticmethod
+    def _Key(fields, used):
+        last = fields['author'].split(" and ")[0].split(",")[0].split()[-1]
+        word = fields['title'].split()[0]
+        stem = "".join(c for c in f"{last}{fields['year']}{word}" if c.isalnum()).lower() or "anon"
+
+        key = stem
+        suffix = 0
+        while key in used:
+            suffix += 1
+            key = f"{stem}-{suffix}"
+        used.add(key)
+        return key
+
+    @staticmethod
+    def _Entry(rand, key, fields):
+        quoted = rand.random() < 0.3
+        lines = [f"@{fields['type']}{{{key},"]
+        lines.append(f'  title = "{{{fields["title"]}}}",' if quoted else
+                     f"  title = {{{fields['title']}}},")
+        lines.append(f"  author = {{{fields['author']}}},")
+        if fields['venue'] is not None:
+            lines.append(f"  {fields['venue'][0]} = {fields['venue'][1]},")
+        for name in ('publisher', 'pages', 'doi', 'eprint'):
+            if fields[name] is not None:
+                lines.append(f"  {name} = {{{fields[name]}}},")
+        if fields['eprint'] is not None:
+            lines.append("  archiveprefix = {arXiv},")
+        if fields['month'] is not None:
+            lines.append(f"  month = {fields['month']},")
+        lines.append(f"  year = {fields['year']}")
+        lines.append("}\n")
+        return "\n".join(lines)
+
+class Benchmark:
+    """Times the hot paths of main.py on the bib files of a directory.
+
+    Every timing is repeated, and results keep each run along with the best
+    and the median of them, keyed by benchmark name.
+    """
+
+    # Query mixes: frequent words, rare words, author names, several keywords,
+    # a title typed one letter at a time, and queries matching nothing.
+    QUERY_MIXES = {
+        'common': ["learning", "network", "data", "model", "graph"],
+        'rare': ["polyhedral", "succinct", "speculative", "hyperbolic", "transactional"],
+        'author': ["Wang", "Smith", "Kumar", "Santos", "Garc"],
+        'multi': ["deep reinforcement learning", "graph neural network",
+                  "wang learning", "efficient cache memory", "smith 2020"],
+        'typing': ["tra", "tran", "trans", "transf", "transfo", "transfor", "transform",
+                   "transforme", "transformer", "transformer at", "transformer att"],
+        'miss': ["zzyzx", "frobnicate quux", "qwertyuiop"],
+    }
+
+    PANEL_SIZE = (100, 60)
+    PANEL_PAGES = 20
+    SELECTED = 50
+
+    def __init__(self, paths, repeat=3, workers=1):
+        self.paths = paths
+        self.repeat = repeat
+        self.workers = workers
+        self.glob = os.path.join(os.path.dirname(paths[0]), "*.bib")
+        self.results = {}
+
+    def Run(self, only=None):
+        for name, method in (('load', self.Load), ('match', self.Match), ('search', self.Search),
+                             ('panel', self.Panel), ('write', self.Write)):
+            if only is None or name in only:
+                method()
+        return self.results
+
+    def Load(self):
+        """BibtexRepo.LoadingThreadMain with pybtex, with the scanner, and from the cache."""
+        cases = (('load.parse', {'cache': False, 'scan': False}),
+                 ('load.scan', {'cache': False, 'scan': True}),
+                 ('load.cached', {'cache': True, 'scan': True}))
+
+        # Fill the cache, for load.cached.
+        self._LoadedRepo({'cache': True, 'scan': True})
+
+        for name, config in cases:
+            entries = None
+            def Load():
+                nonlocal entries
+                entries = len(self._LoadedRepo(config).bib_entries)
+            self._Time(name, Load, entries=lambda: entries)
+
+    def Match(self):
+        """BibEntry.Match over every entry, for each query of each mix."""
+        entries = self._LoadedRepo({'cache': True, 'scan': True}).bib_entries
+
+        for mix, queries in Benchmark.QUERY_MIXES.items():
+            hits = 0
+            def Scan():
+                nonlocal hits
+                hits = 0
+                for query in queries:
+                    keywords = query.split()
+                    hits += sum(1 for entry in entries if entry.Match(keywords))
+            self._Time(f"match.{mix}", Scan, queries=len(queries),
+                       entries=len(entries), hits=lambda: hits)
+
+    def Search(self):
+        """The repo search the UI runs: index candidates, matching and ranking."""
+        repo = self._LoadedRepo({'cache': True, 'scan': True})
+
+        for mix, queries in Benchmark.QUERY_MIXES.items():
+            shown = 0
+            def Search():
+                nonlocal shown
+                shown = 0
+                repo.last_search = None
+                for query in queries:
+                    # Like the results panel, each ranking replaces what came before.
+                    shown_now = []
+                    token = main.SearchToken(
+                        repo, repo.serial,
+                        on_ranked=lambda items: shown_now.__setitem__(slice(None), items))
+                    for entry in repo.SearchingThreadMain(query, token):
+                        shown_now.append(entry)
+                    shown += len(shown_now)
+            self._Time(f"search.{mix}", Search, queries=len(queries), shown=lambda: shown)
+
+    def Panel(self):
+        """SearchResultsPanel: streaming hits in, ranked replacements, and scrolling."""
+        repo = self._LoadedRepo({'cache': True, 'scan': True})
+        entries = repo.bib_entries
+        top_k = repo.top_k
+
+        def Add():
+            panel = Benchmark._Panel()
+            for i in range(0, len(entries), main.BibRepo.EMIT_BATCH):
+                panel.AddBatch(entries[i:i + main.BibRepo.EMIT_BATCH], panel.serial)
+        self._Time('panel.add', Add, entries=len(entries))
+
+        def Replace():
+            panel = Benchmark._Panel()
+            for i in range(0, len(entries), top_k):
+                panel.ReplaceRepoResults(repo, entries[i:i + top_k], panel.serial)
+        self._Time('panel.replace', Replace, replacements=-(-len(entries) // top_k))
+
+        def Scroll():
+            panel = Benchmark._Panel()
+            panel.AddBatch(entries, panel.serial)
+            for _ in range(Benchmark.PANEL_PAGES):
+                panel.render(Benchmark.PANEL_SIZE, focus=True)
+                panel.keypress(Benchmark.PANEL_SIZE, 'page down')
+        self._Time('panel.scroll', Scroll, pages=Benchmark.PANEL_PAGES,
+                   setup=lambda: [entry.ReleaseSearchPanelWidget() for entry in entries])
+
+    def Write(self):
+        """OutputBibtexRepo.Write of the first file plus a few selected entries."""
+        directory = tempfile.mkdtemp(prefix="bibrarian-write-")
+        output_file = os.path.join(directory, "reference.bib")
+        output_repo = None
+        written = []
+
+        def Setup():
+            nonlocal output_repo
+            shutil.copy(self.paths[0], output_file)
+            output_repo = main.OutputBibtexRepo(output_file, main.RedrawScheduler(None), True,
+                                                {'cache': False})
+            output_repo.loading_done.wait()
+            output_repo.selected_keys_panel = main.SelectedKeysPanel(None)
+
+            # Entries fresh from the cache, so that writing parses them in full
+            # as it does in the UI.
+            for entry in self._LoadedRepo({'cache': True, 'scan': True}).bib_entries[-Benchmark.SELECTED:]:
+                output_repo.selected_keys_panel.Add(entry)
+
+        try:
+            self._Time('write', lambda: written.__setitem__(slice(None), output_repo.Write()),
+                       setup=Setup, selected=Benchmark.SELECTED, written=lambda: len(written),
+                       bytes=lambda: os.path.getsize(output_file))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _LoadedRepo(self, config):
+        repo = main.BibtexRepo(self.glob, main.RedrawScheduler(None), True,
+                               dict(config, workers=self.workers, watch=False))
+        repo.loading_done.wait()
+        return repo
+
+    @staticmethod
+    def _Panel():
+        panel = main.SearchResultsPanel()
+        panel.serial = 1
+        return panel
+
+    def _Time(self, name, function, setup=None, **info):
+        seconds = []
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            gc.collect()
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+
+        result = {'seconds': seconds, 'best': min(seconds), 'median': statistics.median(seconds)}
+        result.update((k, v() if callable(v) else v) for k, v in info.items())
+        self.results[name] = result
+        print(f"{name:>16}: {result['best'] * 1000:9.1f} ms best, "
+              f"{result['median'] * 1000:9.1f} ms median", file=sys.stderr)
+
+    @staticmethod
+    def Compare(results, baseline, threshold):
+        """Prints the change of every benchmark; returns the names of regressions."""
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+
+            ratio = result['best'] / baseline[name]['best'] if baseline[name]['best'] else 1.0
+            verdict = ""
+            if ratio > 1 + threshold:
+                verdict = "  SLOWER"
+                regressions.append(name)
+            elif ratio < 1 - threshold:
+                verdict = "  faster"
+            print(f"{name:>16}: {baseline[name]['best'] * 1000:9.1f} -> "
+                  f"{result['best'] * 1000:9.1f} ms ({ratio:.2f}x){verdict}", file=sys.stderr)
+        return regressions
+
+class ArgParser(argparse.ArgumentParser):
+    def __init__(self):
+        super().__init__(prog="benchmark.py",
+                         description="Time loading, searching and writing bib files "
+                                     "on a synthetic corpus.")
+
+        self.add_argument("-n", "--entries",
+                          help="number of entries in the corpus",
+                          default=10000,
+                          type=int)
+        self.add_argument("--files",
+                          help="number of bib files the corpus is split into",
+                          default=10,
+                          type=int)
+        self.add_argument("--seed",
+                          help="seed of the corpus generator",
+                          default=0,
+                          type=int)
+        self.add_argument("-r", "--repeat",
+                          help="runs of each benchmark",
+                          default=3,
+                          type=int)
+        self.add_argument("--workers",
+                          help="parsing processes of the repos, 0 for one per CPU",
+                          default=1,
+                          type=int)
+        self.add_argument("--only",
+                          help="comma-separated benchmarks to run: load, match, search, panel, write",
+                          action='store')
+        self.add_argument("--corpus",
+                          help="write the corpus into DIR and keep it, instead of a temporary directory",
+                          metavar="DIR",
+                          action='store')
+        self.add_argument("-o", "--output",
+                          help="write the results to FILE instead of stdout",
+                          metavar="FILE",
+                          action='store')
+        self.add_argument("--compare",
+                          help="compare the results with those of an earlier run",
+                          metavar="BASELINE",
+                          action='store')
+        self.add_argument("--threshold",
+                          help="with --compare, relative slowdown that counts as a regression",
+                          default=0.1,
+                          type=float)
+
+def GitRevision():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=directory,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               cwd=directory, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{revision}-dirty" if dirty.strip() else revision
+
+if __name__ == '__main__':
+    args = ArgParser().parse_args()
+    only = set(args.only.split(",")) if args.only else None
+
+    # Warnings the repos log about the corpus (e.g. key collisions) would
+    # otherwise go to stderr in the middle of the report.
+    logging.basicConfig(level=logging.ERROR)
+
+    corpus_dir = args.corpus or tempfile.mkdtemp(prefix="bibrarian-corpus-")
+    cache_dir = tempfile.mkdtemp(prefix="bibrarian-cache-")
+    # Keep the bib cache of the benchmark away from the user's.
+    os.environ['XDG_CACHE_HOME'] = cache_dir
+
+    try:
+        os.makedirs(corpus_dir, exist_ok=True)
+        paths = CorpusGenerator(args.entries, args.files, args.seed).Write(corpus_dir)
+        corpus_bytes = sum(os.path.getsize(path) for path in paths)
+        results = Benchmark(paths, args.repeat, args.workers).Run(only)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        if args.corpus is None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    report = {
+        'revision': GitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'corpus': {'entries': args.entries, 'files': args.files, 'seed': args.seed,
+                   'bytes': corpus_bytes},
+        'repeat': args.repeat,
+        'workers': args.workers,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('corpus') != report['corpus']:
+            print("benchmark.py: the baseline ran on another corpus", file=sys.stderr)
+        sys.exit(1 if Benchmark.Compare(results, baseline['results'], args.threshold) else 0)
@@ -0,0 +1,303 @@
+import argparse
+import getpass
+import hashlib
+import json
+import os
+import socket
+import stat
+import sys
+import time
+
+class DaemonClient:
+    """Sends requests to the daemon serving a config (see BibrarianDaemon)."""
+
+    # Seconds a single-response request may take.
+    TIMEOUT = 10
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+    @staticmethod
+    def SocketPath(config_source):
+        base = os.environ.get('XDG_RUNTIME_DIR') or "/tmp"
+        digest = hashlib.sha1(os.path.realpath(config_source).encode('utf-8')).hexdigest()
+        return os.path.join(base, f"bibrarian-{getpass.getuser()}", f"{digest[:16]}.sock")
+
+    @staticmethod
+    def CheckDirectory(path, create=False):
+        """Raises PermissionError unless path is a directory of this user only.
+
+        The socket directory may be under a shared /tmp, where another user
+        could have made it first to plant a socket of their own.
+        """
+        if create:
+            try: os.mkdir(path, 0o700)
+            except FileExistsError: pass
+
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise PermissionError(f"'{path}' is not a directory private to user {getpass.getuser()}")
+
+    def Request(self, request, timeout=None):
+        """Yields the response lines; raises OSError if no daemon listens."""
+        DaemonClient.CheckDirectory(os.path.dirname(self.socket_path))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(request).encode('utf-8') + b"\n")
+            with sock.makefile('rb') as f:
+                for line in f:
+                    yield line
+
+    def Call(self, request, timeout=TIMEOUT):
+        """Returns the single response object of a request."""
+        for line in self.Request(request, timeout):
+            response = json.loads(line)
+            if 'error' in response:
+                raise RuntimeError(response['error'])
+            return response
+        raise ConnectionError("the daemon closed the connection")
+
+    def Ping(self):
+        try:
+            return self.Call({'op': 'ping'}, timeout=1)
+        except (OSError, RuntimeError, ValueError):
+            return None
+
+class DefaultConfig(dict):
+    def __init__(self):
+        self['ro_repos'] = [
+            {
+                'remote': "dblp.org",
+                'enabled': True,
+                'debounce': 0.3,
+                'timeout': 10,
+                'cache_ttl': 604800,
+                'offline': False,
+                'fetch_workers': 4,
+                'prefetch': 0,
+                'prefetch_nearby': 0
+            },
+            {
+                'glob': "/path/to/lots/of/**/*.bib",
+                'enabled': True,
+                'workers': 4,
+                'top_k': 500,
+                'watch': True,
+                'scan': True
+            },
+            {
+                'index': "/path/to/lab/mirror.bibidx",
+                'enabled': True,
+                'top_k': 500
+            },
+            {
+                'glob': "/path/to/sample.bib",
+                'enabled': False
+            },
+            {
+                'glob': "/path/to/another/sample.bib"
+            }
+        ]
+
+        self['rw_repos'] = [
+            {
+                'glob': "reference.bib",
+                'enabled': True
+            }
+        ]
+
+    def Write(self, file):
+        with open(file, 'w') as f:
+            json.dump(self, f, indent=4)
+
+class Config(dict):
+    def __init__(self, file_name):
+        prefix = os.getcwd()
+        self.source = None
+
+        while True:
+            path = os.path.join(prefix, file_name)
+            if os.path.isfile(path) and os.access(path, os.R_OK):
+                with open(path) as f:
+                    self.update(json.load(f))
+                    self.source = path
+                    break
+
+            if prefix == '/': break
+            prefix = os.path.dirname(prefix)
+
+        if self.source is None:
+            print("Did not find any config file.")
+            print("You can generate an example config file using option -g.")
+            print("For more information, please use option -h for help.")
+            sys.exit(1)
+
+        self._NormalizePaths()
+
+    def _NormalizePaths(self):
+        config_dir = os.path.dirname(os.path.realpath(self.source))
+        for repo_group in (self[k] for k in ('ro_repos', 'rw_repos')):
+            for repo_config in repo_group:
+                for key in ('glob', 'index'):
+                    if key in repo_config:
+                        repo_config[key] = os.path.expandvars(os.path.expanduser(repo_config[key]))
+
+                        if not os.path.isabs(repo_config[key]):
+                            repo_config[key] = os.path.join(config_dir, repo_config[key])
+
+
+class ArgParser(argparse.ArgumentParser):
+    def __init__(self):
+        super().__init__(prog="bibrarian")
+
+        self.add_argument("-f", "--config",
+                          help="force configuration file path",
+                          default=".bibrarian_config.json",
+                          action='store'
+                          )
+        self.add_argument("-g", "--gen-config",
+                          help="generate a configuration file",
+                          default=False,
+                          action='store_true')
+        self.add_argument("-l", "--log",
+                          help="force log file path",
+                          default=f"/tmp/{getpass.getuser()}_babrarian.log",
+                          action='store')
+        self.add_argument("-k", "--keys-output",
+                          help="output bib keys file (truncate mode)",
+                          action='store')
+        self.add_argument("-q", "--query",
+                          help="print the entries matching QUERY as JSON lines, without the UI",
+                          metavar="QUERY",
+                          action='store')
+        self.add_argument("--limit",
+                          help="with --query, print at most N entries per repo",
+                          metavar="N",
+                          type=int,
+                          action='store')
+        self.add_argument("--repos",
+                          help="with --query, comma-separated repos to search: their numbers "
+                               "in the UI or parts of their glob, index or remote",
+                          metavar="REPOS",
+                          action='store')
+        self.add_argument("--daemon",
+                          help="keep the configured repos loaded and serve the UI and "
+                               "--query from them",
+                          default=False,
+                          action='store_true')
+        self.add_argument("--stop-daemon",
+                          help="stop the daemon serving the configuration file",
+                          default=False,
+                          action='store_true')
+        self.add_argument("--no-daemon",
+                          help="load the repos in this process even if a daemon serves them",
+                          default=False,
+                          action='store_true')
+        self.add_argument("--export-dblp-store",
+                          help="export the stored DBLP bibtex records to a file",
+                          metavar="FILE",
+                          action='store')
+        self.add_argument("--import-dblp-store",
+                          help="import DBLP bibtex records exported by --export-dblp-store",
+                          metavar="FILE",
+                          action='store')
+        self.add_argument("--build-index",
+                          help="index the bib files matching GLOB into the file INDEX, "
+                               "for use as an 'index' repo",
+                          metavar=("GLOB", "INDEX"),
+                          nargs=2)
+        self.add_argument("--validate-scanner",
+                          help="check the fast bib scanner against pybtex on the matched files",
+                          metavar="GLOB",
+                          nargs='+')
+        self.add_argument("--stats-json",
+                          help="write the performance counters of every repo to FILE on exit",
+                          metavar="FILE",
+                          action='store')
+        self.add_argument("--startup-profile",
+                          help="print how long each phase of the startup took, on exit",
+                          default=False,
+                          action='store_true')
+        self.add_argument("-v", "--version",
+                          action='version',
+                          version="%(prog)s 1.0")
+
+class StartupProfile:
+    """Wall-clock time of each phase of the startup, for --startup-profile.
+
+    Phases are timed with perf_counter from the moment Main starts; starting
+    python itself comes before and is not included (time the whole launch,
+    e.g. of bibrarian -v, for that). The UI should take keys within TARGET
+    seconds of the launch.
+    """
+
+    TARGET = 0.3
+
+    def __init__(self):
+        self.phases = []
+        self._last = time.perf_counter()
+
+    def Mark(self, phase):
+        """Ends the phase running since the last mark."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def Report(self, file=sys.stderr):
+        for phase, seconds in self.phases:
+            print(f"{phase:>12}: {seconds * 1000:7.1f} ms", file=file)
+        total = sum(seconds for _, seconds in self.phases)
+        print(f"{'total':>12}: {total * 1000:7.1f} ms "
+              f"(target {StartupProfile.TARGET * 1000:.0f} ms)", file=file)
+
+def Main():
+    startup_profile = StartupProfile()
+    args = ArgParser().parse_args()
+
+    if args.gen_config:
+        DefaultConfig().Write(args.config)
+        print(f"Wrote default config to file {args.config}")
+        sys.exit(0)
+
+    # Stopping a daemon or relaying a query to it needs none of what follows.
+    if args.stop_daemon or (args.query is not None and not args.no_daemon):
+        daemon_client = DaemonClient(DaemonClient.SocketPath(Config(args.config).source))
+        startup_profile.Mark("config")
+
+        if args.stop_daemon:
+            if daemon_client.Ping() is None:
+                print("bibrarian: no daemon serves this configuration", file=sys.stderr)
+                sys.exit(1)
+            daemon_client.Call({'op': 'shutdown'})
+            sys.exit(0)
+
+        if daemon_client.Ping() is not None:
+            failed = 0
+            try:
+                for line in daemon_client.Request({'op': 'query', 'query': args.query,
+                                                   'limit': args.limit, 'repos': args.repos}):
+                    response = json.loads(line)
+                    if 'done' in response:
+                        failed = response['failed']
+                    elif 'error' in response:
+                        print(f"bibrarian: {response['error']}", file=sys.stderr)
+                        failed += 1
+                    else:
+                        sys.stdout.write(line.decode('utf-8'))
+                        sys.stdout.flush()
+            except KeyboardInterrupt:
+                sys.exit(130)
+
+            startup_profile.Mark("query")
+            if args.startup_profile:
+                startup_profile.Report()
+            sys.exit(1 if failed else 0)
+
+    # Everything else needs the rest of bibrarian, which takes a while to import.
+    import main
+    startup_profile.Mark("imports")
+    main.Main(args, startup_profile)
+
+if __name__ == '__main__':
+    Main()
@@ -1,25 +1,31 @@
-import argparse
-import getpass
+import array
+import collections
+import concurrent.futures
+import fcntl
 import glob
 import hashlib
+import heapq
 import itertools
 import json
 import logging
+import mmap
 import os
+import pickle
+import queue
+import re
+import select
+import socketserver
+import struct
 import sys
 import threading
 import time
 import traceback
 import subprocess
-
-import urllib
-import urllib.request
-import urllib.parse
+import zlib
 
 import urwid
 
-import pybtex
-import pybtex.database
+from cli import Config, DaemonClient
 
 class BibEntry:
     class SearchPanelWidgetImpl(urwid.AttrMap):
@@ -49,7 +55,7 @@ class BibEntry:
             self.set_focus_map({k: ('plain' if k is None else str(k)) + '+' for k in [
                 'title', 'author', 'delim', 'venue', 'year', 'source',
                 'bibkey', 'mark_none', 'mark_selected', 'title_delim',
-                'bibtex_ready', 'bibtex_fetching', None]})
+                'bibtex_ready', 'bibtex_fetching', 'bibtex_failed', None]})
 
         def selectable(self):
             return True
@@ -59,12 +65,19 @@ class BibEntry:
                 self.entry.repo.selected_keys_panel.Toggle(self.entry)
                 self.entry.OnSelectionHandler()
             elif key == 'i':
-                self.entry.repo.details_panel.original_widget = self.entry.details_widget
+                try:
+                    self.entry.repo.details_panel.original_widget = self.entry.details_widget
+                except Exception as e:
+                    logging.error(f"Could not get the details of {self.entry.bibkey}: {e}")
+                    self.entry.repo.message_bar.Post(
+                            f"Could not get the details of {self.entry.bibkey}.", 'error')
             elif key == '@':
                 self.entry.OpenInBrowser()
             else:
                 return key
 
+    __slots__ = ('repo', '_source', '_search_panel_widget', '_mark')
+
     def __init__(self, source, repo):
         self.repo = repo
         self._source = source
@@ -139,16 +152,24 @@ class BibEntry:
 
     @mark.setter
     def mark(self, value):
-        self._InitializeSearchPanelWidget()
+        if value not in (None, 'selected'):
+            raise ValueError(f"Invalid mark: {value}")
+
         self._mark = value
-        if value is None:
+        if self._search_panel_widget is not None:
+            self._ApplyMark()
+
+    def ReleaseSearchPanelWidget(self):
+        """Drops the row widget; it is rebuilt, mark included, when next needed."""
+        self._search_panel_widget = None
+
+    def _ApplyMark(self):
+        if self._mark is None:
             self._search_panel_widget.mark.original_widget.set_text(
                     [('title_delim', "["), ('mark_none', " "), ('title_delim', "]")])
-        elif value == 'selected':
+        else:
             self._search_panel_widget.mark.original_widget.set_text(
                     [('title_delim', "["), ('mark_selected', "X"), ('title_delim', "]")])
-        else:
-            raise ValueError(f"Invalid mark: {mark}")
 
     @property
     def unique_key(self):
@@ -160,6 +181,8 @@ class BibEntry:
 
     def OnSelectionHandler(self): pass
 
+    def OnNearFocus(self, distance): pass
+
     def OpenInBrowser(self):
         if self.url is None:
             self.repo.message_bar.Post("Could not infer url of this entry.",
@@ -179,6 +202,7 @@ class BibEntry:
     def _InitializeSearchPanelWidget(self):
         if self._search_panel_widget is None:
             self._search_panel_widget = BibEntry.SearchPanelWidgetImpl(self)
+            self._ApplyMark()
 
 class DblpEntry(BibEntry):
 
@@ -221,22 +245,16 @@ class DblpEntry(BibEntry):
 
         self._details_widget = None
         self._bibkey = None
-        self._redraw_fd = None
 
         self.pybtex_entry = None
+        self.bibtex_loading_future = None
         self.bibtex_loading_done = threading.Event()
-
-        self.bibtex_loading_thread = threading.Thread(
-                name=f"bibtex-{self.bibkey}",
-                target=self._LoadPybtexEntry,
-                daemon=False)
-
-    def __del__(self):
-        if self._redraw_fd is not None:
-            os.close(self._redraw_fd)
+        self._selection_time = None
+        self._bibtex_state = None
 
     @property
     def pyb_entry(self):
+        self.StartLoading()
         self.bibtex_loading_done.wait()
         return self.pybtex_entry
 
@@ -284,45 +302,102 @@ class DblpEntry(BibEntry):
         return self._details_widget
 
     def OnSelectionHandler(self):
-        if self._redraw_fd is None:
-            event_loop = self.repo.event_loop
-            self._redraw_fd = event_loop.watch_pipe(self._FdWriteHandler)
-            self.bibtex_loading_thread.start()
+        if self._selection_time is None:
+            self._selection_time = time.time()
+        self.StartLoading()
+
+    def OnNearFocus(self, distance):
+        if self.repo.prefetch_nearby and distance <= self.repo.prefetch_nearby:
+            self.Prefetch(SearchToken(self.repo, self.repo.serial))
+
+    def Prefetch(self, token):
+        """Fetches the bibtex into the store ahead of a possible selection."""
+        if self.bibtex_loading_future is None:
+            self.repo.fetcher.Prefetch(self.data['info']['key'], self._PrefetchBibtex, token)
+
+    def StartLoading(self):
+        # A fetch that failed is started over; one under way is left alone.
+        if self.bibtex_loading_future is not None and \
+                not (self.bibtex_loading_done.is_set() and self.pybtex_entry is None):
+            return
+        self.bibtex_loading_done.clear()
+
+        bib_text = self.repo.bibtex_store.Get(self.data['info']['key'])
+        if bib_text is not None:
+            self.bibtex_loading_future = concurrent.futures.Future()
+            self._ParseBibtex(bib_text)
+            self._OnBibtexReady()
+            self.bibtex_loading_done.set()
+            self.bibtex_loading_future.set_result(None)
+            return
 
-    def _FdWriteHandler(self, data):
-        self.repo.event_loop.draw_screen()
+        self._SetBibtexState(('bibtex_fetching', " (bibtex queued)"))
+        self.bibtex_loading_future = self.repo.fetcher.Submit(self._LoadPybtexEntry)
+
+    def _OnBibtexReady(self):
+        self._SetBibtexState(('bibtex_ready', " (bibtex ready)"))
+        if self._selection_time is not None:
+            self.repo.RecordSelectionLatency(time.time() - self._selection_time)
+
+    def _PrefetchBibtex(self):
+        key = self.data['info']['key']
+        if self.repo.bibtex_store.Get(key) is None:
+            bib_text = self.repo.fetcher.connections.Get(self.bib_url, self.repo.timeout)
+            self.repo.stats.AddBytes(len(bib_text))
+            self.repo.bibtex_store.Put(key, bib_text.decode('utf-8'))
+
+    def _ParseBibtex(self, bib_text):
+        import pybtex.database
+        pyb_db = pybtex.database.parse_string(bib_text, 'bibtex')
+        self.pybtex_entry = pyb_db.entries[f"DBLP:{self.data['info']['key']}"]
+
+    def _SetBibtexState(self, state):
+        self._bibtex_state = state
+        if self._search_panel_widget is not None:
+            self._ApplyBibtexState()
+            self.repo.Redraw()
+
+    def _ApplyBibtexState(self):
+        self._search_panel_widget.source.set_text([
+            ('source', f"{self.source}"),
+            ('delim', "::"),
+            ('bibkey', f"{self.bibkey}"),
+            self._bibtex_state])
+
+    def _InitializeSearchPanelWidget(self):
+        if self._search_panel_widget is None:
+            super()._InitializeSearchPanelWidget()
+            if self._bibtex_state is not None:
+                self._ApplyBibtexState()
 
     def _InitializeDetailsWidget(self):
         if self._details_widget is None:
             self._details_widget = DblpEntry.DetailsWidgetImpl(self)
 
+    @property
+    def bib_url(self):
+        return f"{self.repo.base_url}/rec/bib2/{self.data['info']['key']}.bib"
+
     def _LoadPybtexEntry(self):
-        bib_url = f"https://dblp.org/rec/bib2/{self.data['info']['key']}.bib"
+        key = self.data['info']['key']
         try:
-            if self.search_panel_widget is not None:
-                self.search_panel_widget.source.set_text([
-                    ('source', f"{self.source}"),
-                    ('delim', "::"),
-                    ('bibkey', f"{self.bibkey}"),
-                    ('bibtex_fetching', " (fetching bibtex)")])
-                os.write(self._redraw_fd, b"?")
+            self._SetBibtexState(('bibtex_fetching', " (fetching bibtex)"))
 
-            with urllib.request.urlopen(bib_url) as remote:
-                bib_text = remote.read().decode('utf-8')
+            # A prefetch of this very record may already be on the wire.
+            self.repo.fetcher.WaitPrefetch(key)
+            bib_text = self.repo.bibtex_store.Get(key)
+            if bib_text is None:
+                bib_data = self.repo.fetcher.connections.Get(self.bib_url, self.repo.timeout)
+                self.repo.stats.AddBytes(len(bib_data))
+                bib_text = bib_data.decode('utf-8')
+                self.repo.bibtex_store.Put(key, bib_text)
 
-            pyb_db = pybtex.database.parse_string(bib_text, 'bibtex')
-            self.pybtex_entry = pyb_db.entries[f"DBLP:{self.data['info']['key']}"]
-
-            if self.search_panel_widget is not None:
-                self.search_panel_widget.source.set_text([
-                    ('source', f"{self.source}"),
-                    ('delim', "::"),
-                    ('bibkey', f"{self.bibkey}"),
-                    ('bibtex_ready', " (bibtex ready)")])
-                os.write(self._redraw_fd, b"?")
+            self._ParseBibtex(bib_text)
+            self._OnBibtexReady()
 
         except Exception as e:
             logging.error(f"Error when fetching bibtex entry from DBLP: Entry: {self.data} {traceback.format_exc()}")
+            self._SetBibtexState(('bibtex_failed', " (bibtex failed)"))
 
         self.bibtex_loading_done.set()
 
@@ -366,51 +441,61 @@ class BibtexEntry(BibEntry):
                              (self.info, ('pack', None)),
                              (urwid.SolidFill(), ('weight', 1))]
 
-    def __init__(self, key, entry, repo, source):
-        super().__init__(source, repo)
-        self._bibkey = key
-        self.entry = entry
+    __slots__ = ('_store', '_row', '_entry', '_details_widget')
+
+    def __init__(self, store, row, repo):
+        super().__init__(store.sources[row], repo)
+        self._store = store
+        self._row = row
+        self._entry = None
         self._details_widget = None
 
+    @property
+    def row(self):
+        return self._row
+
+    def Move(self, store, row):
+        """Points the view at the row its entry has in a compacted store."""
+        self._store = store
+        self._row = row
+
+    @property
+    def entry(self):
+        if self._entry is None:
+            _, self._entry = BibRecord.ToPybtex(self._store.Record(self._row))
+        return self._entry
+
     @property
     def authors(self):
-        try: return [str(au) for au in self.entry.persons['author']]
-        except: return ["Unknown"]
+        return list(self._store.authors[self._row])
 
     @property
     def title(self):
-        try: return self.entry.fields['title']
-        except: return "Unknown"
+        return self._store.titles[self._row]
 
     @property
     def year(self):
-        try: return self.entry.fields['year']
-        except: return "Unknown"
+        return self._store.years[self._row]
 
     @property
     def venue(self):
-        try:
-            if 'booktitle' in self.entry.fields:
-                return self.entry.fields['booktitle']
-            elif 'journal' in self.entry.fields:
-                return self.entry.fields['journal']
-            elif 'publisher' in self.entry.fields:
-                return f"Publisher: {self.entry.fields['publisher']}"
-        except: return "Unknown"
+        return self._store.venues[self._row]
 
     @property
     def bibkey(self):
-        return self._bibkey
+        return self._store.bibkeys[self._row]
 
     @property
     def url(self):
-        try: return self.entry.fields['url']
-        except: return None
+        return self._store.urls[self._row]
 
     @property
     def pyb_entry(self):
         return self.entry
 
+    def Match(self, keywords):
+        return self._store.Match(self._row, keywords)
+
     @property
     def details_widget(self):
         self._InitializeDetailsWidget()
@@ -420,20 +505,1242 @@ class BibtexEntry(BibEntry):
         if self._details_widget is None:
             self._details_widget = BibtexEntry.DetailsWidgetImpl(self)
 
+class BibRecord:
+    """Compact, picklable form of a parsed pybtex entry.
+
+    A record is a plain tuple (key, type, fields, persons) where fields is a
+    tuple of (name, value) pairs and persons is a tuple of (role, people)
+    pairs, each person being a tuple of its five name-part lists.
+    """
+
+    _NAME_PARTS = ('first_names', 'middle_names', 'prelast_names',
+                   'last_names', 'lineage_names')
+
+    @staticmethod
+    def FromPybtex(key, entry):
+        persons = tuple(
+            (role, tuple(tuple(tuple(getattr(p, part)) for part in BibRecord._NAME_PARTS)
+                         for p in people))
+            for role, people in entry.persons.items())
+        return (key, entry.type, tuple(entry.fields.items()), persons)
+
+    @staticmethod
+    def ToPybtex(record):
+        import pybtex.database
+        key, entry_type, fields, persons = record
+        entry = pybtex.database.Entry(entry_type, fields=list(fields))
+        for role, people in persons:
+            for parts in people:
+                # Bypass Person.__init__, which would re-split every name part.
+                person = pybtex.database.Person.__new__(pybtex.database.Person)
+                for part, names in zip(BibRecord._NAME_PARTS, parts):
+                    setattr(person, part, list(names))
+                entry.add_person(person, role)
+        return key, entry
+
+    @staticmethod
+    def PersonName(parts):
+        """Same as str() of the pybtex Person built from the name parts."""
+        first, middle, prelast, last, lineage = parts
+        von_last = " ".join(prelast + last)
+        jr = " ".join(lineage)
+        first = " ".join(first + middle)
+        return ", ".join(part for part in (von_last, jr, first) if part)
+
+    @staticmethod
+    def ParseFile(path):
+        import pybtex.database
+        bib_data = pybtex.database.parse_file(path)
+        return [BibRecord.FromPybtex(key, entry) for key, entry in bib_data.entries.items()]
+
+class BibScanner:
+    """Streaming scanner for the displayed fields of a bib file.
+
+    Parsing a file with pybtex builds every field and person of every entry,
+    while the search panel only ever shows a handful of them. The scanner
+    walks the raw bytes with the same grammar as pybtex, but only decodes
+    the key, title, authors, year and venue of each entry. What it yields
+    are scanned records, i.e. BibRecords holding just those fields plus a
+    fifth item, the span of the entry in the file, from which Materialize
+    parses the full entry with pybtex when it is asked for.
+
+    Anything the scanner is not sure to read the way pybtex does (syntax
+    errors, duplicate keys or fields, undefined macros, undecodable text)
+    makes it give up on the file, which is then parsed with pybtex.
+    """
+
+    FIELDS = frozenset(('title', 'year', 'booktitle', 'journal', 'publisher', 'url'))
+    PERSON_FIELDS = frozenset(('author', 'editor'))  # pybtex.database.Person.valid_roles
+
+    _NAME_CHARS = rb"A-Za-z@!$&*+\-./:;<>?\[\\\]^_`|~\x7f"
+    _NAME = re.compile(rb"\s*([" + _NAME_CHARS + rb"][" + _NAME_CHARS + rb"0-9]*)")
+    _NUMBER = re.compile(rb"\s*([0-9]+)")
+    _KEY_BRACE = re.compile(rb"\s*([^\s,}]+)")
+    _KEY_PAREN = re.compile(rb"\s*([^\s,]+)")
+    _TOKEN = re.compile(rb"\s*(.)", re.DOTALL)
+    _BRACE_SPECIALS = re.compile(rb"[{}]")
+    _QUOTE_SPECIALS = re.compile(rb'[{}"]')
+
+    # Name parts by name string. Authors recur a lot across a bibliography,
+    # and splitting their names is most of the work left for the scanner.
+    PERSON_CACHE_SIZE = 1 << 16
+    _person_parts = {}
+
+    class Unscannable(Exception):
+        pass
+
+    @staticmethod
+    def ScanFile(path):
+        """Scanned records of the file, or full ones if it cannot be scanned."""
+        try:
+            with open(path, 'rb') as f:
+                return BibScanner(f.read()).Scan()
+        except BibScanner.Unscannable as e:
+            logging.debug(f"Falling back to pybtex for file {path}: {e}")
+            return BibRecord.ParseFile(path)
+
+    @staticmethod
+    def Materialize(path, record):
+        """Full BibRecord of a scanned record, parsed from its span."""
+        key, _, _, _, (offset, length, strings) = record
+        chunks = []
+        with open(path, 'rb') as f:
+            for chunk_offset, chunk_length in strings + ((offset, length),):
+                f.seek(chunk_offset)
+                chunks.append(f.read(chunk_length))
+
+        import pybtex.database
+        bib_data = pybtex.database.parse_string(b"\n".join(chunks).decode('utf-8'), 'bibtex')
+        if key not in bib_data.entries:
+            raise ValueError(f"entry {key} is no longer at offset {offset}")
+
+        return BibRecord.FromPybtex(key, bib_data.entries[key])
+
+    @staticmethod
+    def Validate(path):
+        """Differences between the scanned and the pybtex-parsed file."""
+        with open(path, 'rb') as f:
+            try:
+                scanned = BibScanner(f.read()).Scan()
+            except BibScanner.Unscannable as e:
+                return [f"not scannable, would fall back to pybtex: {e}"]
+
+        parsed = BibRecord.ParseFile(path)
+        if [r[0] for r in scanned] != [r[0] for r in parsed]:
+            return [f"scanned {len(scanned)} keys, pybtex parsed {len(parsed)}, "
+                    f"or in a different order"]
+
+        scanned_store, parsed_store = BibtexEntryStore(), BibtexEntryStore()
+        problems = []
+        for scanned_record, parsed_record in zip(scanned, parsed):
+            key = parsed_record[0]
+            scanned_row = scanned_store.Append(path, scanned_record)
+            parsed_row = parsed_store.Append(path, parsed_record)
+
+            for column in ('titles', 'authors', 'years', 'venues', 'urls'):
+                scanned_value = getattr(scanned_store, column)[scanned_row]
+                parsed_value = getattr(parsed_store, column)[parsed_row]
+                if scanned_value != parsed_value:
+                    problems.append(f"{key}: {column} {scanned_value!r} != {parsed_value!r}")
+
+            if scanned_record[1] != parsed_record[1]:
+                problems.append(f"{key}: type {scanned_record[1]!r} != {parsed_record[1]!r}")
+
+            if BibScanner.Materialize(path, scanned_record) != parsed_record:
+                problems.append(f"{key}: materialized entry differs from the parsed one")
+
+        return problems
+
+    def __init__(self, data):
+        import pybtex.database.input.bibtex
+        self.data = data
+        self.pos = 0
+        self.macros = {name.encode('utf-8'): value.encode('utf-8') for name, value in
+                       pybtex.database.input.bibtex.month_names.items()}
+
+    def Scan(self):
+        records = []
+        keys = set()
+        strings = ()
+
+        while True:
+            start = self.data.find(b"@", self.pos)
+            if start < 0:
+                return records
+            self.pos = start + 1
+
+            command = self._Required(BibScanner._NAME, "command").lower()
+            opening = self._Required(BibScanner._TOKEN, "'{' or '('")
+            if opening not in (b"{", b"("):
+                raise BibScanner.Unscannable(f"expected '{{' or '(' at byte {self.pos}")
+            closing = b"}" if opening == b"{" else b")"
+
+            if command == b"comment":
+                # Like pybtex, skip just the command and go on from its body.
+                continue
+            elif command == b"string":
+                name = self._Required(BibScanner._NAME, "macro name")
+                self._Expect(b"=")
+                value = self._Value()
+                self._Expect(closing)
+                self.macros[name.lower()] = value
+                strings = strings + ((start, self.pos - start),)
+            elif command == b"preamble":
+                self._Value()
+                self._Expect(closing)
+            else:
+                key_pattern = BibScanner._KEY_BRACE if closing == b"}" else BibScanner._KEY_PAREN
+                key = self._Decode(self._Required(key_pattern, "entry key"))
+                if key.lower() in keys:
+                    raise BibScanner.Unscannable(f"repeated entry {key}")
+                keys.add(key.lower())
+
+                fields, persons = self._Fields(key)
+                self._Expect(closing)
+                records.append((key, self._Decode(command).lower(), fields, persons,
+                                (start, self.pos - start, strings)))
+
+    def _Fields(self, key):
+        import pybtex.bibtex.utils
+        import pybtex.textutils
+        fields = []
+        persons = []
+        seen = set()
+
+        while True:
+            match = BibScanner._NAME.match(self.data, self.pos)
+            if match:
+                self.pos = match.end()
+                name = match.group(1)
+                self._Expect(b"=")
+                value = self._Value()
+
+                folded_name = name.lower()
+                if folded_name in seen:
+                    raise BibScanner.Unscannable(f"entry {key} has a duplicate {self._Decode(name)} field")
+                seen.add(folded_name)
+
+                folded_name = self._Decode(folded_name)
+                if folded_name in BibScanner.PERSON_FIELDS:
+                    if folded_name == 'author':
+                        value = pybtex.textutils.normalize_whitespace(self._Decode(value))
+                        persons.append((self._Decode(name), tuple(
+                            BibScanner._PersonParts(person)
+                            for person in pybtex.bibtex.utils.split_name_list(value))))
+                elif folded_name in BibScanner.FIELDS:
+                    value = pybtex.textutils.normalize_whitespace(self._Decode(value))
+                    fields.append((self._Decode(name), value))
+
+            match = BibScanner._TOKEN.match(self.data, self.pos)
+            if not match or match.group(1) != b",":
+                return tuple(fields), tuple(persons)
+            self.pos = match.end()
+
+    def _Value(self):
+        parts = [self._ValuePart()]
+        while True:
+            match = BibScanner._TOKEN.match(self.data, self.pos)
+            if not match or match.group(1) != b"#":
+                return b"".join(parts)
+            self.pos = match.end()
+            parts.append(self._ValuePart())
+
+    def _ValuePart(self):
+        match = BibScanner._TOKEN.match(self.data, self.pos)
+        if not match:
+            raise BibScanner.Unscannable("premature end of file")
+
+        delimiter = match.group(1)
+        if delimiter in (b"{", b'"'):
+            self.pos = match.end()
+            return self._String(delimiter == b'"')
+
+        number = BibScanner._NUMBER.match(self.data, self.pos)
+        if number:
+            self.pos = number.end()
+            return number.group(1)
+
+        name = self._Required(BibScanner._NAME, "field value").lower()
+        if name not in self.macros:
+            raise BibScanner.Unscannable(f"undefined string {self._Decode(name)}")
+        return self.macros[name]
+
+    def _String(self, quoted):
+        start = self.pos
+        specials = BibScanner._QUOTE_SPECIALS if quoted else BibScanner._BRACE_SPECIALS
+        depth = 0
+
+        while True:
+            match = specials.search(self.data, self.pos)
+            if not match:
+                raise BibScanner.Unscannable("premature end of file")
+            self.pos = match.end()
+
+            char = match.group()
+            if char == b"{":
+                depth += 1
+            elif depth > 0:
+                if char == b"}":
+                    depth -= 1
+            elif char == b"}" and quoted:
+                raise BibScanner.Unscannable(f"unbalanced braces at byte {self.pos}")
+            else:
+                return self.data[start:self.pos - 1]
+
+    def _Required(self, pattern, description):
+        match = pattern.match(self.data, self.pos)
+        if not match:
+            raise BibScanner.Unscannable(f"expected {description} at byte {self.pos}")
+        self.pos = match.end()
+        return match.group(1)
+
+    def _Expect(self, token):
+        if self._Required(BibScanner._TOKEN, repr(token.decode())) != token:
+            raise BibScanner.Unscannable(f"expected {token.decode()!r} at byte {self.pos}")
+
+    @staticmethod
+    def _Decode(data):
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise BibScanner.Unscannable(str(e))
+
+    @staticmethod
+    def _PersonParts(name):
+        parts = BibScanner._person_parts.get(name)
+        if parts is None:
+            import pybtex.database
+            person = pybtex.database.Person(name)
+            parts = tuple(tuple(getattr(person, part)) for part in BibRecord._NAME_PARTS)
+
+            if len(BibScanner._person_parts) >= BibScanner.PERSON_CACHE_SIZE:
+                BibScanner._person_parts.clear()
+            BibScanner._person_parts[name] = parts
+        return parts
+
+class BibCache:
+    """On-disk cache of parsed bib files.
+
+    Each bib file gets one zlib-compressed pickle holding its records along
+    with the mtime, size and sha1 of the file it was parsed from. A cached
+    file is reused if its stat info matches, or failing that, if its content
+    hash still matches (e.g. after a touch or a copy).
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = BibCache.DefaultDirectory()
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def DefaultDirectory():
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser("~/.cache")
+        return os.path.join(base, "bibrarian", "bib")
+
+    def Load(self, path):
+        try:
+            with open(self._CachePath(path), 'rb') as f:
+                cached = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Discarding unreadable cache for file {path}: {e}")
+            return None
+
+        if cached.get('version') != BibCache.VERSION or cached.get('path') != os.path.realpath(path):
+            return None
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        if (st.st_mtime_ns, st.st_size) == (cached['mtime'], cached['size']):
+            return cached['records']
+
+        if st.st_size == cached['size'] and BibCache._Digest(path) == cached['sha1']:
+            self.Store(path, cached['records'], cached['sha1'])
+            return cached['records']
+
+        return None
+
+    def Store(self, path, records, sha1=None):
+        try:
+            st = os.stat(path)
+            cached = {'version': BibCache.VERSION,
+                      'path': os.path.realpath(path),
+                      'mtime': st.st_mtime_ns,
+                      'size': st.st_size,
+                      'sha1': sha1 if sha1 is not None else BibCache._Digest(path),
+                      'records': records}
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            cache_path = self._CachePath(path)
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(cached, pickle.HIGHEST_PROTOCOL)))
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logging.warning(f"Could not cache parsed file {path}: {e}")
+
+    def _CachePath(self, path):
+        digest = hashlib.sha1(os.path.realpath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.v{BibCache.VERSION}.pickle.z")
+
+    @staticmethod
+    def _Digest(path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+class BibtexEntryStore:
+    """Columnar storage of the entries of a BibtexRepo.
+
+    Every entry is a row across parallel lists holding its interned display
+    strings and their upper-cased search forms. The row's BibRecord is kept
+    pickled, and the pybtex entry is rebuilt from it only when asked for; a
+    scanned record is kept as is and parsed from its file instead (see
+    BibScanner). BibtexEntry is a thin view over a row.
+    """
+
+    def __init__(self):
+        self.sources = []
+        self.bibkeys = []
+        self.titles = []
+        self.authors = []
+        self.years = []
+        self.venues = []
+        self.urls = []
+        self.blobs = []
+
+        self.folded_keys = []
+        self.folded_titles = []
+        self.folded_authors = []
+
+        # Publication years as numbers for ranking, 0 if unknown.
+        self.year_values = array.array('H')
+
+        # Rows of entries whose file was changed or removed since. They are
+        # never reused, and never match again; Compacted drops them.
+        self.dead = bytearray()
+
+    def __len__(self):
+        return len(self.bibkeys)
+
+    COLUMNS = ('sources', 'bibkeys', 'titles', 'authors', 'years', 'venues', 'urls', 'blobs',
+               'folded_keys', 'folded_titles', 'folded_authors', 'year_values')
+
+    def Compacted(self):
+        """Copy without the dead rows, and the new row of each old one (-1 if dead)."""
+        live = [row for row in range(len(self.dead)) if not self.dead[row]]
+        remap = [-1] * len(self.dead)
+        for new_row, row in enumerate(live):
+            remap[row] = new_row
+
+        store = BibtexEntryStore()
+        for name in BibtexEntryStore.COLUMNS:
+            column = getattr(self, name)
+            getattr(store, name).extend(column[row] for row in live)
+        store.dead = bytearray(len(live))
+        return store, remap
+
+    def Append(self, source, record):
+        key, _, fields, persons = record[:4]
+        fields = {name.lower(): value for name, value in fields}
+        persons = {role.lower(): people for role, people in persons}
+        source = sys.intern(source)
+
+        if 'author' in persons:
+            authors = tuple(sys.intern(BibRecord.PersonName(p)) for p in persons['author'])
+        else:
+            authors = ("Unknown",)
+
+        if 'booktitle' in fields:
+            venue = fields['booktitle']
+        elif 'journal' in fields:
+            venue = fields['journal']
+        elif 'publisher' in fields:
+            venue = f"Publisher: {fields['publisher']}"
+        else:
+            venue = None
+
+        title = fields.get('title', "Unknown")
+
+        self.sources.append(source)
+        self.bibkeys.append(key)
+        self.titles.append(title)
+        self.authors.append(authors)
+        self.years.append(sys.intern(fields.get('year', "Unknown")))
+        year_digits = re.match(r"\s*(\d{4})", fields.get('year', ""))
+        self.year_values.append(int(year_digits.group(1)) if year_digits else 0)
+        self.venues.append(sys.intern(venue) if venue is not None else None)
+        self.urls.append(fields.get('url'))
+        if len(record) > 4:
+            self.blobs.append(record)
+        else:
+            self.blobs.append(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+
+        self.folded_keys.append(f"{source}::{key}".upper())
+        self.folded_titles.append(title.upper())
+        self.folded_authors.append(tuple(sys.intern(a.upper()) for a in authors))
+        self.dead.append(0)
+
+        return len(self.bibkeys) - 1
+
+    def Remove(self, row):
+        self.dead[row] = 1
+
+    @property
+    def live_count(self):
+        return len(self.dead) - self.dead.count(1)
+
+    def Record(self, row):
+        blob = self.blobs[row]
+        if isinstance(blob, bytes):
+            return pickle.loads(blob)
+
+        source = self.sources[row]
+        try:
+            return BibScanner.Materialize(source, blob)
+        except Exception as e:
+            logging.warning(f"Could not parse entry {blob[0]} of file {source} where it was scanned: {e}")
+
+        # The file changed since it was scanned. The scanned fields are only
+        # those displayed, so the entry has to be found in the file as it is.
+        for record in BibRecord.ParseFile(source):
+            if record[0] == blob[0]:
+                return record
+        raise LookupError(f"entry {blob[0]} is no longer in file {source}")
+
+    def Match(self, row, keywords):
+        """Same as BibEntry.Match on the entry stored at the row."""
+        if self.dead[row]:
+            return False
+
+        folded_key = self.folded_keys[row]
+        folded_title = self.folded_titles[row]
+        folded_authors = self.folded_authors[row]
+
+        trivial = True
+        for keyword in filter(lambda k: len(k) >= 3, keywords):
+            trivial = False
+            keyword = keyword.upper()
+
+            if keyword in folded_key or keyword in folded_title:
+                continue
+
+            if not any(keyword in author for author in folded_authors):
+                return False
+
+        return not trivial
+
+    def Grams(self, row):
+        grams = NgramIndex.Grams(self.folded_keys[row])
+        grams.update(NgramIndex.Grams(self.folded_titles[row]))
+        for author in self.folded_authors[row]:
+            grams.update(NgramIndex.Grams(author))
+        return grams
+
+class NgramIndex:
+    """Inverted trigram index over the searchable fields of entries.
+
+    Keywords shorter than three characters never take part in matching (see
+    BibEntry.Match), so every keyword that does can be looked up by its
+    trigrams. The posting lists only narrow down candidates; callers still
+    verify each candidate with BibEntry.Match.
+    """
+
+    N = 3
+
+    def __init__(self):
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._postings)
+
+    @staticmethod
+    def Grams(text):
+        n = NgramIndex.N
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def Add(self, doc_id, grams):
+        postings = self._postings
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array.array('I')
+            posting.append(doc_id)
+
+    def Remapped(self, remap):
+        """Copy with every id d replaced by remap[d], without those mapped to -1.
+
+        remap must keep the order of the ids it keeps, as that of
+        BibtexEntryStore.Compacted does, for the postings to stay sorted.
+        """
+        index = NgramIndex()
+        for gram, posting in self._postings.items():
+            kept = array.array('I', (remap[d] for d in posting if remap[d] >= 0))
+            if kept:
+                index._postings[gram] = kept
+        return index
+
+    def Candidates(self, keywords):
+        """Returns the sorted ids of documents that may match all keywords."""
+        return NgramIndex.Intersect([self._postings.get(g, ())
+                                     for g in NgramIndex.KeywordGrams(keywords)])
+
+    @staticmethod
+    def KeywordGrams(keywords):
+        grams = set()
+        for keyword in filter(lambda k: len(k) >= NgramIndex.N, keywords):
+            grams.update(NgramIndex.Grams(keyword.upper()))
+        return grams
+
+    @staticmethod
+    def Intersect(postings):
+        if not postings:
+            return []
+
+        postings = sorted(postings, key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates: break
+            candidates.intersection_update(posting)
+
+        return sorted(candidates)
+
+class BibIndex:
+    """Read-only, memory-mapped index of the entries of many bib files.
+
+    Built once with Build, e.g. for a lab-wide mirror of bib files, and then
+    opened by any number of processes at nearly no cost: the file is mapped
+    read-only and shared through the page cache, and only the pages that a
+    search touches ever become resident. It offers the same interface as a
+    BibtexEntryStore together with an NgramIndex, so a BibtexRepo can
+    search it unchanged.
+
+    The file is laid out as a header, a string table, the entry table, the
+    gram table and the posting lists. Each entry-table row holds the
+    (offset, length) of its strings: source, key, title, authors (one per
+    line), year, venue, url, the folded search text (key, title and
+    authors, upper-cased, one per line) and the zlib-compressed pickle of
+    its BibRecord. The gram table is sorted by gram so lookups are binary
+    searches, and every posting list is a sorted array of row numbers.
+    """
+
+    MAGIC = b"BIBIDX\x00\x01"
+    HEADER = struct.Struct("<8sQQQQQ")
+    ENTRY = struct.Struct("<" + "QI" * 9 + "H2x")
+    GRAM = struct.Struct("<12sQI4x")
+
+    SOURCE, KEY, TITLE, AUTHORS, YEAR, VENUE, URL, FOLDED, RECORD = range(9)
+
+    # Length of an absent string, e.g. of an entry without venue.
+    ABSENT = 0xFFFFFFFF
+
+    class _Column:
+        """Sequence view of one column, read from the mapped file per row."""
+
+        def __init__(self, index, get):
+            self.index = index
+            self.get = get
+
+        def __len__(self):
+            return len(self.index)
+
+        def __getitem__(self, row):
+            return self.get(row)
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mm) < BibIndex.HEADER.size:
+            raise ValueError(f"{path} is not a bibrarian index")
+
+        magic, self._entry_count, self._gram_count, self._strings_end, \
+            self._grams_offset, self._postings_offset = BibIndex.HEADER.unpack_from(self._mm)
+        if magic != BibIndex.MAGIC:
+            raise ValueError(f"{path} is not a bibrarian index of this version")
+
+        self._entries_offset = self._strings_end
+
+        String = lambda field: lambda row: self._String(row, field)
+        Folded = lambda row: self._String(row, BibIndex.FOLDED).split("\n")
+
+        self.sources = BibIndex._Column(self, String(BibIndex.SOURCE))
+        self.bibkeys = BibIndex._Column(self, String(BibIndex.KEY))
+        self.titles = BibIndex._Column(self, String(BibIndex.TITLE))
+        self.authors = BibIndex._Column(self, lambda row: tuple(
+                                        self._String(row, BibIndex.AUTHORS).split("\n")))
+        self.years = BibIndex._Column(self, String(BibIndex.YEAR))
+        self.venues = BibIndex._Column(self, String(BibIndex.VENUE))
+        self.urls = BibIndex._Column(self, String(BibIndex.URL))
+        self.folded_keys = BibIndex._Column(self, lambda row: Folded(row)[0])
+        self.folded_titles = BibIndex._Column(self, lambda row: Folded(row)[1])
+        self.folded_authors = BibIndex._Column(self, lambda row: tuple(Folded(row)[2:]))
+        self.year_values = BibIndex._Column(self, lambda row: self._Row(row)[-1])
+
+        # Nothing is ever removed from an index; it is rebuilt instead.
+        self.dead = BibIndex._Column(self, lambda row: 0)
+
+    def __len__(self):
+        return self._entry_count
+
+    @property
+    def live_count(self):
+        return self._entry_count
+
+    def _Row(self, row):
+        if not 0 <= row < self._entry_count:
+            raise IndexError(row)
+        return BibIndex.ENTRY.unpack_from(self._mm, self._entries_offset + row * BibIndex.ENTRY.size)
+
+    def _Bytes(self, row, field):
+        fields = self._Row(row)
+        offset, length = fields[2 * field], fields[2 * field + 1]
+        if length == BibIndex.ABSENT:
+            return None
+        return self._mm[offset:offset + length]
+
+    def _String(self, row, field):
+        data = self._Bytes(row, field)
+        return data.decode('utf-8') if data is not None else None
+
+    def Record(self, row):
+        return pickle.loads(zlib.decompress(self._Bytes(row, BibIndex.RECORD)))
+
+    def Match(self, row, keywords):
+        """Same as BibEntry.Match on the entry stored at the row."""
+        folded = self._String(row, BibIndex.FOLDED)
+
+        # Keywords never contain a newline, so none can match across the
+        # key, title and authors.
+        trivial = True
+        for keyword in filter(lambda k: len(k) >= 3, keywords):
+            trivial = False
+            if keyword.upper() not in folded:
+                return False
+
+        return not trivial
+
+    def Candidates(self, keywords):
+        """Same as NgramIndex.Candidates, over the mapped posting lists."""
+        return NgramIndex.Intersect([self._Posting(g) for g in NgramIndex.KeywordGrams(keywords)])
+
+    def _Posting(self, gram):
+        key = gram.encode('utf-32-le')
+        lo, hi = 0, self._gram_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, offset, count = BibIndex.GRAM.unpack_from(
+                self._mm, self._grams_offset + mid * BibIndex.GRAM.size)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                posting = memoryview(self._mm)[offset:offset + 4 * count].cast('I')
+                if sys.byteorder != 'little':
+                    posting = array.array('I', posting)
+                    posting.byteswap()
+                return posting
+        return ()
+
+    @staticmethod
+    def Build(glob_expr, path, workers=0):
+        """Indexes the bib files matching glob_expr into path; returns the entry count."""
+        bib_files = sorted(glob.glob(glob_expr, recursive=True))
+        workers = workers or os.cpu_count() or 1
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            writer = BibIndex._Writer(f)
+
+            # Parse a window of files at a time, so that parsed files do not
+            # pile up in memory while earlier ones are still being written.
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                for start in range(0, len(bib_files), 2 * workers):
+                    window = bib_files[start:start + 2 * workers]
+                    futures = [pool.submit(BibRecord.ParseFile, bib_file) for bib_file in window]
+                    for bib_file, future in zip(window, futures):
+                        try:
+                            records = future.result()
+                        except Exception as e:
+                            logging.error(f"Exception raised when parsing file {bib_file}: {e}")
+                            continue
+
+                        writer.Add(bib_file, records)
+                        logging.debug(f"Indexed {len(records)} entries of file {bib_file}")
+
+            writer.Finish()
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Processes that have the old index open keep their mapping of it.
+        os.replace(tmp_path, path)
+        return writer.entry_count
+
+    class _Writer:
+        """Streams the string table out and keeps the rest until Finish."""
+
+        def __init__(self, f):
+            self.f = f
+            self.entry_count = 0
+            self._strings = {}
+            self._entries = bytearray()
+            self._postings = {}
+
+            f.write(bytes(BibIndex.HEADER.size))
+
+        def Add(self, bib_file, records):
+            store = BibtexEntryStore()
+            for record in records:
+                row = store.Append(bib_file, record)
+                folded = "\n".join((store.folded_keys[row], store.folded_titles[row])
+                                   + store.folded_authors[row])
+
+                locations = (self._Put(bib_file, True),
+                             self._Put(store.bibkeys[row]),
+                             self._Put(store.titles[row]),
+                             self._Put("\n".join(store.authors[row])),
+                             self._Put(store.years[row], True),
+                             self._Put(store.venues[row], True),
+                             self._Put(store.urls[row]),
+                             self._Put(folded),
+                             self._Put(zlib.compress(store.blobs[row])))
+                self._entries += BibIndex.ENTRY.pack(*itertools.chain(*locations),
+                                                     store.year_values[row])
+
+                for gram in store.Grams(row):
+                    posting = self._postings.get(gram)
+                    if posting is None:
+                        posting = self._postings[gram] = array.array('I')
+                    posting.append(self.entry_count)
+                self.entry_count += 1
+
+        def Finish(self):
+            f = self.f
+            strings_end = f.tell()
+            f.write(self._entries)
+
+            grams = sorted((gram.encode('utf-32-le'), gram) for gram in self._postings)
+            grams_offset = f.tell()
+            postings_offset = grams_offset + len(grams) * BibIndex.GRAM.size
+
+            offset = postings_offset
+            for key, gram in grams:
+                f.write(BibIndex.GRAM.pack(key, offset, len(self._postings[gram])))
+                offset += 4 * len(self._postings[gram])
+
+            for _, gram in grams:
+                posting = self._postings[gram]
+                if sys.byteorder != 'little':
+                    posting.byteswap()
+                f.write(posting.tobytes())
+
+            f.seek(0)
+            f.write(BibIndex.HEADER.pack(BibIndex.MAGIC, self.entry_count, len(grams),
+                                         strings_end, grams_offset, postings_offset))
+
+        def _Put(self, value, intern=False):
+            """Writes a string out; returns its (offset, length)."""
+            if value is None:
+                return 0, BibIndex.ABSENT
+            if intern and value in self._strings:
+                return self._strings[value]
+
+            data = value if isinstance(value, bytes) else value.encode('utf-8')
+            location = (self.f.tell(), len(data))
+            self.f.write(data)
+            if intern:
+                self._strings[value] = location
+            return location
+
+class RelevanceScorer:
+    """Scores how well a stored entry matches the keywords of a query.
+
+    Every effective keyword contributes the weight of the best field it
+    hits, doubled when it hits a whole word rather than part of one, and
+    recent entries get a bonus that halves every RECENCY_HALF_LIFE years.
+    """
+
+    KEY_WEIGHT = 3.0
+    TITLE_WEIGHT = 2.0
+    AUTHOR_WEIGHT = 2.5
+    WHOLE_WORD_FACTOR = 2.0
+
+    RECENCY_WEIGHT = 1.0
+    RECENCY_HALF_LIFE = 10
+
+    def __init__(self, keywords):
+        self.keywords = [(k.upper(), re.compile(rf"(?<!\w){re.escape(k.upper())}(?!\w)"))
+                         for k in keywords if len(k) >= 3]
+        self.current_year = time.localtime().tm_year
+
+    def Score(self, store, row):
+        folded_key = store.folded_keys[row]
+        folded_title = store.folded_titles[row]
+        folded_authors = store.folded_authors[row]
+
+        score = 0.0
+        for keyword, whole_word in self.keywords:
+            best = 0.0
+            for weight, texts in ((RelevanceScorer.KEY_WEIGHT, (folded_key,)),
+                                  (RelevanceScorer.TITLE_WEIGHT, (folded_title,)),
+                                  (RelevanceScorer.AUTHOR_WEIGHT, folded_authors)):
+                for text in texts:
+                    if keyword not in text:
+                        continue
+                    if whole_word.search(text):
+                        weight *= RelevanceScorer.WHOLE_WORD_FACTOR
+                    best = max(best, weight)
+                    break
+            score += best
+
+        year = store.year_values[row]
+        if year:
+            age = max(0, self.current_year - year)
+            score += RelevanceScorer.RECENCY_WEIGHT * 0.5 ** (age / RelevanceScorer.RECENCY_HALF_LIFE)
+
+        return score
+
+class SearchToken:
+    """Lets a running search notice that a newer one superseded it.
+
+    Searches call Checkpoint every CHUNK entries and stop as soon as it
+    returns True, so a stale search gives up within CHUNK entries.
+
+    Searches that run outside the repo's own searching thread (see
+    QueryRunner) pass on_ranked to receive rankings in place of the search
+    results panel, and may lower the repo's top_k with limit.
+    """
+
+    CHUNK = 256
+
+    def __init__(self, repo, serial, on_ranked=None, limit=None):
+        self.repo = repo
+        self.serial = serial
+        self.on_ranked = on_ranked
+        self.limit = limit
+        self.work = 0
+        self.aborted = False
+        self.start_time = time.time()
+
+        # Matches found, as counted by the repo; may exceed what is shown.
+        self.hits = 0
+
+    @property
+    def cancelled(self):
+        return self.repo.serial != self.serial
+
+    def Wait(self, seconds):
+        """Waits up to the given time for a newer search; True if one came."""
+        with self.repo._serial_changed:
+            return self.repo._serial_changed.wait_for(lambda: self.cancelled, seconds)
+
+    def Checkpoint(self, work):
+        """Records the amount of work done so far; True if the search should stop."""
+        self.work = work
+        if self.cancelled:
+            self.aborted = True
+        return self.aborted
+
+    def EmitRanked(self, items):
+        if self.on_ranked is not None:
+            self.on_ranked(items)
+        else:
+            self.repo.EmitRanked(items, self.serial)
+
+class RedrawScheduler:
+    """Coalesces repaint requests from background threads into frames.
+
+    Threads call Request whenever they changed something on screen. The
+    scheduler owns the only watch_pipe of the event loop and triggers at
+    most one draw_screen per interval, however many requests came in.
+    Without an event loop (e.g. in query mode) requests are only counted.
+    Call runs a function on the event loop thread along with a redraw.
+    """
+
+    def __init__(self, event_loop, interval=1 / 30):
+        self.event_loop = event_loop
+        self.interval = interval
+
+        # Requests come from many threads, redraws only from the event loop.
+        self.requests = 0
+        self._requests_lock = threading.Lock()
+        self.redraws = 0
+        self._pending = threading.Event()
+        self._calls = collections.deque()
+
+        if event_loop is not None:
+            self._redraw_fd = event_loop.watch_pipe(self._FdWriteHandler)
+            self._thread = threading.Thread(name="redraw", target=self._ThreadMain, daemon=True)
+            self._thread.start()
+
+    @property
+    def coalescing_ratio(self):
+        return self.requests / self.redraws if self.redraws else 0.0
+
+    def Request(self):
+        with self._requests_lock:
+            self.requests += 1
+        self._pending.set()
+
+    def Call(self, fn):
+        if self.event_loop is None:
+            fn()
+            return
+
+        self._calls.append(fn)
+        self.Request()
+
+    def _ThreadMain(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            try:
+                os.write(self._redraw_fd, b"?")
+            except:
+                logging.error(traceback.format_exc())
+            time.sleep(self.interval)
+
+    def _FdWriteHandler(self, data):
+        # May raise urwid.ExitMainLoop, which ends the event loop.
+        while self._calls:
+            self._calls.popleft()()
+
+        self.redraws += 1
+        self.event_loop.draw_screen()
+
+class FileWatcher:
+    """Waits until files in a set of directories may have changed.
+
+    Uses inotify where the C library has it and falls back to sleeping for
+    the poll interval otherwise. Either way the caller rescans afterwards,
+    so a wake-up only needs to be a hint.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+                 IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    # Editors write files in several steps; wait for the burst to settle.
+    SETTLE_DELAY = 0.2
+
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+        self._watched = set()
+        self._libc = None
+        self._fd = None
+
+        try:
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._libc, self._fd = libc, fd
+        except (OSError, AttributeError):
+            pass
+
+        if self._fd is None:
+            logging.debug(f"inotify unavailable; polling every {poll_interval} s")
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+    def Watch(self, directories):
+        if self._fd is None:
+            return
+
+        for directory in set(directories) - self._watched:
+            if self._libc.inotify_add_watch(self._fd, os.fsencode(directory),
+                                            FileWatcher.WATCH_MASK) >= 0:
+                self._watched.add(directory)
+
+    def Wait(self):
+        if self._fd is None:
+            time.sleep(self.poll_interval)
+            return
+
+        # Still rescan now and then, in case an event was missed (e.g. for a
+        # directory created after the watches were set up).
+        if select.select([self._fd], [], [], self.poll_interval * 10)[0]:
+            time.sleep(FileWatcher.SETTLE_DELAY)
+        self._Drain()
+
+    def _Drain(self):
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+class RepoStats:
+    """Performance counters of a repo, for the Database Info panel and --stats-json.
+
+    Latencies and hit counts are kept for the last WINDOW searches that ran
+    to the end; aborted searches are counted by the repo instead.
+    """
+
+    WINDOW = 256
+
+    def __init__(self):
+        self.load_seconds = None
+        self.searches = 0
+        self.bytes_fetched = 0
+        self.latencies = collections.deque(maxlen=RepoStats.WINDOW)
+        self.hits = collections.deque(maxlen=RepoStats.WINDOW)
+        self._lock = threading.Lock()
+
+    def RecordSearch(self, seconds, hits):
+        with self._lock:
+            self.searches += 1
+            self.latencies.append(seconds)
+            self.hits.append(hits)
+
+    def AddBytes(self, count):
+        with self._lock:
+            self.bytes_fetched += count
+
+    @property
+    def last_latency(self):
+        with self._lock:
+            return self.latencies[-1] if self.latencies else None
+
+    @property
+    def p95_latency(self):
+        with self._lock:
+            return RepoStats.Percentile(self.latencies, 0.95)
+
+    @property
+    def hits_per_query(self):
+        with self._lock:
+            return sum(self.hits) / len(self.hits) if self.hits else None
+
+    @staticmethod
+    def Percentile(values, fraction):
+        values = sorted(values)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    @staticmethod
+    def Abbreviate(number):
+        """E.g. 950, 12.3k or 4.5M."""
+        for unit in ("", "k", "M"):
+            if number < 1000:
+                return f"{number:.1f}{unit}" if unit else f"{number:.0f}"
+            number /= 1000
+        return f"{number:.1f}G"
+
+    @staticmethod
+    def Dump(repos, path):
+        with open(path, 'w') as f:
+            json.dump({'repos': [repo.StatsObject() for repo in repos]}, f, indent=4)
+        logging.info(f"Wrote repo stats to file '{path}'")
+
 class BibRepo:
 
+    # Search results are handed to the results panel in batches of up to
+    # EMIT_BATCH items, or whatever arrived within EMIT_INTERVAL seconds.
+    EMIT_BATCH = 64
+    EMIT_INTERVAL = 0.05
+
+    class _Batcher:
+        """Hands the results of a search to Emit in batches.
+
+        A batch that is not full goes out EMIT_INTERVAL after its first item
+        from a flush thread, one per search, so that results come out while
+        the search blocks, e.g. on the network, and not only once the next
+        item or the end came. Close flushes the rest and stops the thread.
+        """
+
+        def __init__(self, repo, token):
+            self.repo = repo
+            self.token = token
+            self._items = []
+            self._first_time = None
+            self._closed = False
+            self._changed = threading.Condition()
+            self._thread = None
+
+        def Add(self, item):
+            with self._changed:
+                self._items.append(item)
+                if len(self._items) >= BibRepo.EMIT_BATCH:
+                    self._Flush()
+                elif len(self._items) == 1:
+                    self._first_time = time.monotonic()
+                    if self._thread is None:
+                        self._thread = threading.Thread(name=f"emit-{self.repo.source}",
+                                                        target=self._FlushingThreadMain,
+                                                        daemon=True)
+                        self._thread.start()
+                    self._changed.notify()
+
+        def Close(self):
+            with self._changed:
+                self._closed = True
+                self._Flush()
+                self._changed.notify()
+            if self._thread is not None:
+                self._thread.join()
+
+        def _FlushingThreadMain(self):
+            with self._changed:
+                while not self._closed:
+                    if not self._items:
+                        self._changed.wait()
+                        continue
+
+                    remaining = self._first_time + BibRepo.EMIT_INTERVAL - time.monotonic()
+                    if remaining > 0:
+                        self._changed.wait(remaining)
+                    else:
+                        self._Flush()
+
+        def _Flush(self):
+            # Called with _changed held, which keeps the batches in order.
+            items, self._items = self._items, []
+            if items and not self.token.aborted:
+                self.repo.Emit(items, self.token.serial)
+                self.repo.Redraw()
+
     @staticmethod
-    def Create(config, access, event_loop):
+    def Create(config, access, redraw_scheduler):
         enabled = config.get('enabled', True)
         if 'remote' in config:
-            return DblpRepo(event_loop, enabled)
+            return DblpRepo(redraw_scheduler, enabled, config)
 
         elif 'glob' in config:
             ctor = {'ro': BibtexRepo, 'rw': OutputBibtexRepo}[access]
-            return ctor(config['glob'], event_loop, enabled)
+            return ctor(config['glob'], redraw_scheduler, enabled, config)
+
+        elif 'index' in config and access == 'ro':
+            return IndexedBibtexRepo(config['index'], redraw_scheduler, enabled, config)
         else:
             raise ValueError(f"Invalid config: {config}")
 
+    @staticmethod
+    def ConfigSource(config):
+        """What a repo config points at: its glob, index or remote."""
+        return config.get('glob') or config.get('index') or config.get('remote') or ""
+
     class StatusIndicatorWidgetImpl(urwid.AttrMap):
         def __init__(self, repo):
             super().__init__(urwid.SolidFill(), None)
@@ -443,10 +1750,14 @@ class BibRepo:
 
             self.label = urwid.AttrMap(urwid.Text(f"{repo.source}"), "db_label")
             self.access = urwid.Text("")
+            self.counters = urwid.Text("")
+            self.info = urwid.Text("")
             self.status_indicator = urwid.AttrMap(urwid.Text(""), "db_label")
             self.original_widget = urwid.Columns([('pack', self.repo._short_label),
                                                   ('pack', self.repo._enabled_mark),
                                                   ('weight', 1, self.label),
+                                                  ('pack', self.counters),
+                                                  ('pack', self.info),
                                                   ('pack', self.status_indicator),
                                                   ('pack', self.access)],
                                                  dividechars=1)
@@ -475,16 +1786,18 @@ class BibRepo:
                 else:
                     raise LookupError(f"Invalid status: {status}")
 
-    def __init__(self, source, event_loop, enabled):
+    def __init__(self, source, redraw_scheduler, enabled):
         self.source = source
 
         self.redraw_lock = threading.Lock()
 
-        self.event_loop = event_loop
-        self._redraw_fd = event_loop.watch_pipe(self._FdWriteHandler)
+        self.redraw_scheduler = redraw_scheduler
 
         self.serial = 0
+        self.search_text = ""
+        self._refresh_pending = False
         self._serial_lock = threading.Lock()
+        self._serial_changed = threading.Condition(self._serial_lock)
 
         self.search_results_panel = None
         self.message_bar = None
@@ -492,7 +1805,20 @@ class BibRepo:
         self.details_panel = None
 
         self.loading_done = threading.Event()
+        self.searchable = threading.Event()
         self.searching_done = threading.Event()
+        self.searching_serial = None
+
+        # (keywords, hits) of the last search that ran over the whole repo.
+        self.last_search = None
+
+        # Number of searches aborted by a newer one, and (serial, work done,
+        # seconds spent) of the most recent of them. Work is counted in
+        # entries examined, or in bytes received for remote repos.
+        self.cancelled_searches = 0
+        self.wasted_work = collections.deque(maxlen=64)
+
+        self.stats = RepoStats()
 
         self.loading_thread = threading.Thread(name=f"load-{self.source}",
                                                target=self.LoadingThreadWrapper,
@@ -513,9 +1839,6 @@ class BibRepo:
         self.loading_thread.start()
         self.searching_thread.start()
 
-    def __del__(self):
-        os.close(self._redraw_fd)
-
     @property
     def short_label(self):
         return self._short_label.get_text()
@@ -564,29 +1887,56 @@ class BibRepo:
         return self._status_indicator_widget
 
     def Search(self, search_text, serial):
-        self.search_text = search_text
         with self._serial_lock:
+            self.search_text = search_text
             self.serial = serial
+            self._serial_changed.notify_all()
+        self.searching_done.set()
+
+    def Refresh(self):
+        """Runs the current search again, e.g. after the entries changed."""
+        with self._serial_lock:
+            self._refresh_pending = True
         self.searching_done.set()
 
+    @staticmethod
+    def Refines(keywords, previous_keywords):
+        """Whether whatever matches keywords also matches previous_keywords.
+
+        That holds when every effective previous keyword is contained in some
+        new keyword, e.g. "trans" -> "transf" -> "transformer graph".
+        """
+        new = [k.upper() for k in keywords if len(k) >= 3]
+        old = [k.upper() for k in previous_keywords if len(k) >= 3]
+        return bool(old) and all(any(o in n for n in new) for o in old)
+
+    @property
+    def entry_count(self):
+        """Number of entries loaded, or None for repos that do not load any."""
+        return None
+
     def LoadingThreadWrapper(self):
 
         self.status = "loading"
         self.Redraw()
 
+        start_time = time.time()
         status = self.LoadingThreadMain()
+        self.stats.load_seconds = time.time() - start_time
 
         self.status = status
+        self.UpdateCounters()
         self.Redraw()
 
         self.loading_done.set()
+        self.searchable.set()
 
     def LoadingThreadMain(self):
         return NotImplemented
 
     def SearchingThreadWrapper(self):
 
-        self.loading_done.wait()
+        self.searchable.wait()
         if self.status == 'no file':
             return
 
@@ -594,51 +1944,161 @@ class BibRepo:
             self.searching_done.wait()
             with self._serial_lock:
                 serial = self.serial
+                search_text = self.search_text
+                self._refresh_pending = False
 
+            self.searching_serial = serial
             self.status = "searching"
             self.Redraw()
 
+            token = SearchToken(self, serial)
+            batcher = BibRepo._Batcher(self, token)
             try:
-                for item in self.SearchingThreadMain(self.search_text):
-
-                    if self.selected_entries_panel is not None and \
-                       item.bibkey in self.selected_entries_panel.entries.keys():
-                        item.mark = 'selected'
-                    else:
-                        item.mark = None
+                for item in self.SearchingThreadMain(search_text, token):
+                    if token.cancelled:
+                        token.aborted = True
+                        break
 
-                    if self.search_results_panel is not None:
-                        self.search_results_panel.Add(item, serial)
+                    batcher.Add(item)
             except Exception as e:
                 logging.error(traceback.format_exc())
+            batcher.Close()
+
+            if token.aborted:
+                self._RecordCancelledSearch(token)
+            elif search_text.strip():
+                self.stats.RecordSearch(time.time() - token.start_time, token.hits)
 
-            self.status = "ready"
+            self.status = "ready" if self.loading_done.is_set() else "loading"
+            self.UpdateCounters()
             self.Redraw()
 
             with self._serial_lock:
-                if self.serial == serial:
+                if self.serial == serial and not self._refresh_pending:
                     self.searching_done.clear()
 
-    def Redraw(self):
+    def _RecordCancelledSearch(self, token):
+        elapsed = time.time() - token.start_time
+        self.cancelled_searches += 1
+        self.wasted_work.append((token.serial, token.work, elapsed))
+        logging.debug(f"Search #{token.serial} cancelled after {token.work} entries "
+                      f"and {elapsed * 1000:.1f} ms")
+
+    def UpdateCounters(self):
+        """Shows the stats in compact form, e.g. "12.3k 0.8s 14/40ms 230h 2x 1.2MB".
+
+        That is the entries loaded and how long loading took, the latency of
+        the last search and the 95th percentile, the mean hits per query,
+        the searches cancelled and the bytes fetched from remote.
+        """
+        stats = self.stats
+        parts = []
+        if self.entry_count is not None:
+            parts.append(RepoStats.Abbreviate(self.entry_count))
+            if stats.load_seconds is not None:
+                parts.append(f"{stats.load_seconds:.1f}s")
+        if stats.searches:
+            parts.append(f"{stats.last_latency * 1000:.0f}/{stats.p95_latency * 1000:.0f}ms")
+            parts.append(f"{RepoStats.Abbreviate(stats.hits_per_query)}h")
+        if self.cancelled_searches:
+            parts.append(f"{self.cancelled_searches}x")
+        if stats.bytes_fetched:
+            parts.append(f"{RepoStats.Abbreviate(stats.bytes_fetched)}B")
+
         with self.redraw_lock:
-            try:
-                os.write(self._redraw_fd, b"?")
-            except:
-                logging.error(traceback.format_exc())
+            self._status_indicator_widget.counters.set_text(('db_stats', " ".join(parts)))
+
+    def StatsObject(self):
+        """The stats as a JSON object, for --stats-json."""
+        stats = self.stats
+        return {'repo': self.source,
+                'type': type(self).__name__,
+                'access': self.access_type,
+                'enabled': self.enabled,
+                'status': self.status,
+                'entries': self.entry_count,
+                'load_seconds': stats.load_seconds,
+                'searches': stats.searches,
+                'last_search_seconds': stats.last_latency,
+                'p95_search_seconds': stats.p95_latency,
+                'hits_per_query': stats.hits_per_query,
+                'cancelled_searches': self.cancelled_searches,
+                'bytes_fetched': stats.bytes_fetched}
+
+    def Emit(self, items, serial):
+        self._ApplyMarks(items)
+        if self.search_results_panel is not None:
+            self.search_results_panel.AddBatch(items, serial)
+
+    def EmitRanked(self, items, serial):
+        """Replaces whatever this repo has shown for the search with items."""
+        self._ApplyMarks(items)
+        if self.search_results_panel is not None:
+            self.search_results_panel.ReplaceRepoResults(self, items, serial)
+        self.Redraw()
 
-    def _FdWriteHandler(self, data):
-        self.event_loop.draw_screen()
+    def _ApplyMarks(self, items):
+        for item in items:
+            if self.selected_entries_panel is not None and \
+               item.bibkey in self.selected_entries_panel.entries.keys():
+                item.mark = 'selected'
+            else:
+                item.mark = None
+
+    def Redraw(self):
+        self.redraw_scheduler.Request()
 
 class BibtexRepo(BibRepo):
-    def __init__(self, glob_expr, event_loop, enabled):
-        super().__init__(glob_expr, event_loop, enabled)
+    # Reloads leave dead rows behind; once there are at least COMPACT_MIN of
+    # them and more than COMPACT_RATIO of the live ones, they are dropped.
+    COMPACT_MIN = 1024
+    COMPACT_RATIO = 0.25
+
+    def __init__(self, glob_expr, redraw_scheduler, enabled, config=None):
+        self.config = config if config is not None else {}
         self._bib_files = []
-        self._bib_entries = []
+        self._store = BibtexEntryStore()
+        self._views = {}
+        self._bib_cache = BibCache() if self.config.get('cache', True) else None
+
+        # Guards _store and _live_search while files are still loading,
+        # so that entries landing after a search started are matched against it.
+        self._entries_lock = threading.Lock()
+        self._live_search = None
+        self._index = NgramIndex()
+
+        # Rows and (mtime, size) of each loaded file, for reloading it.
+        self._file_rows = {}
+        self._file_stats = {}
+
+        # Bumped whenever entries change after loading, so that a search
+        # running across a change does not seed the next refinement.
+        self._generation = 0
+
+        # Only the top_k best-ranked matches are shown; 0 shows every match
+        # in file order instead.
+        self.top_k = self.config.get('top_k', 500)
+
+        # Scan files for the displayed fields only, parsing entries in full
+        # when they are opened or written out.
+        self._parse_file = BibScanner.ScanFile if self.config.get('scan', False) \
+                           else BibRecord.ParseFile
+
+        super().__init__(glob_expr, redraw_scheduler, enabled)
 
     @property
     def bib_entries(self):
         self.loading_done.wait()
-        return self._bib_entries
+        return [self.Entry(row) for row in range(len(self._store)) if not self._store.dead[row]]
+
+    @property
+    def entry_count(self):
+        return self._store.live_count
+
+    @property
+    def workers(self):
+        workers = self.config.get('workers', 1)
+        return (os.cpu_count() or 1) if workers == 0 else workers
 
     @property
     def bib_files(self):
@@ -658,34 +2118,315 @@ class BibtexRepo(BibRepo):
                                       'warning')
             return 'no file'
 
-        for path in self._bib_files:
+        # Entries become searchable file by file from here on.
+        self.searchable.set()
 
-            try:
-                bib_data = pybtex.database.parse_file(path)
-            except Exception as e:
-                logging.error(f"Exception raised when parsing file {path}: {e}")
-                continue
+        self._LoadFiles(self._bib_files)
 
-            for key, entry in iter(bib_data.entries.items()):
-                self._bib_entries.append(BibtexEntry(key, entry, self, path))
+        with self._entries_lock:
+            live_search = self._live_search
+            self._live_search = None
 
-            logging.debug(f"Parsed {len(bib_data.entries)} entries from file {path}")
+        # A search that ran while loading saw only part of the entries, and
+        # only a search over all of them may seed the next refinement.
+        if live_search is not None and self.top_k:
+            self.Refresh()
+
+        if self.config.get('watch', False):
+            self._StartWatching()
 
         return 'ready'
 
-    def SearchingThreadMain(self, search_text):
-        stripped = search_text.strip()
-        if not stripped:
+    def _LoadFiles(self, paths):
+        pending = []
+        for path in paths:
+            self._file_stats[path] = BibtexRepo._Stat(path)
+
+            records = self._bib_cache.Load(path) if self._bib_cache is not None else None
+            if records is None:
+                pending.append(path)
+                continue
+
+            logging.debug(f"Loaded {len(records)} cached entries of file {path}")
+            self._AddRecords(path, records)
+
+        if self.workers > 1 and len(pending) > 1:
+            self._ParseInPool(pending)
+        else:
+            for path in pending:
+                try:
+                    records = self._parse_file(path)
+                except Exception as e:
+                    logging.error(f"Exception raised when parsing file {path}: {e}")
+                    continue
+
+                self._OnFileParsed(path, records)
+
+    @staticmethod
+    def _Stat(path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _StartWatching(self):
+        threading.Thread(name=f"watch-{self.source}", target=self._WatchThreadMain,
+                         daemon=True).start()
+
+    def _WatchThreadMain(self):
+        watcher = FileWatcher(self.config.get('poll_interval', 2.0))
+        logging.debug(f"Watching '{self.source}' for changes "
+                      f"({'inotify' if watcher.uses_inotify else 'polling'})")
+
+        while True:
+            watcher.Watch(self._WatchedDirectories())
+            watcher.Wait()
+            try:
+                self._Rescan()
+            except Exception:
+                logging.error(traceback.format_exc())
+
+    def _WatchedDirectories(self):
+        directories = {os.path.dirname(path) for path in self._file_stats}
+
+        static_parts = []
+        for part in self.source.split(os.sep):
+            if re.search(r"[*?[]", part): break
+            static_parts.append(part)
+        base = os.sep.join(static_parts) or os.sep
+        if os.path.isdir(base):
+            directories.add(base)
+            if '**' in self.source:
+                directories.update(root for root, _, _ in os.walk(base))
+
+        return directories
+
+    def _Rescan(self):
+        paths = glob.glob(self.source, recursive=True)
+        present = set(paths)
+        removed = [path for path in self._file_stats if path not in present]
+        changed = [path for path in paths
+                   if self._file_stats.get(path, False) != BibtexRepo._Stat(path)]
+
+        if not removed and not changed:
+            return
+
+        logging.info(f"Reloading '{self.source}': {len(changed)} changed or added, "
+                     f"{len(removed)} removed file(s)")
+
+        for path in removed:
+            self._RemoveFile(path)
+        self._LoadFiles(changed)
+        self._bib_files = paths
+        self._Compact()
+
+        if self.message_bar is not None:
+            self.message_bar.Post(f"Reloaded {len(changed) + len(removed)} file(s) "
+                                  f"of '{self.source}'.", 'normal', 1)
+        self.Refresh()
+
+    def _RemoveFile(self, path):
+        with self._entries_lock:
+            for row in self._file_rows.pop(path, ()):
+                self._store.Remove(row)
+            self._file_stats.pop(path, None)
+            self._generation += 1
+            self.last_search = None
+
+    def _Compact(self):
+        """Drops the dead rows from the store and the index, if there are enough."""
+        with self._entries_lock:
+            dead = len(self._store) - self._store.live_count
+            if dead < BibtexRepo.COMPACT_MIN or dead <= BibtexRepo.COMPACT_RATIO * self._store.live_count:
+                return
+
+            store, remap = self._store.Compacted()
+            self._index = self._index.Remapped(remap)
+            self._file_rows = {path: array.array('I', (remap[row] for row in rows))
+                               for path, rows in self._file_rows.items()}
+
+            # Views of live rows move along, so that the selection and the
+            # results shown stay valid; those of dead rows keep the old store.
+            views = {}
+            for row, view in self._views.items():
+                if remap[row] >= 0:
+                    view.Move(store, remap[row])
+                    views[remap[row]] = view
+            self._views = views
+
+            self._store = store
+            self._generation += 1
+            self.last_search = None
+        logging.debug(f"Compacted '{self.source}': dropped {dead} dead entries")
+
+    def Refresh(self):
+        # Unranked results are only ever appended; start over from scratch.
+        if not self.top_k:
+            with self._serial_lock:
+                serial = self.serial
+            self.EmitRanked([], serial)
+        super().Refresh()
+
+    def _ParseInPool(self, paths):
+        logging.debug(f"Parsing {len(paths)} files with {self.workers} worker processes")
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._parse_file, path): path for path in paths}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    records = future.result()
+                except Exception as e:
+                    logging.error(f"Exception raised when parsing file {path}: {e}")
+                    continue
+
+                self._OnFileParsed(path, records)
+
+    def _OnFileParsed(self, path, records):
+        logging.debug(f"Parsed {len(records)} entries from file {path}")
+        if self._bib_cache is not None:
+            self._bib_cache.Store(path, records)
+
+        self._AddRecords(path, records)
+
+    def Entry(self, row, store=None):
+        if store is not None and store is not self._store:
+            # Found by a search that started before the store was compacted.
+            return BibtexEntry(store, row, self)
+
+        entry = self._views.get(row)
+        if entry is None:
+            entry = self._views.setdefault(row, BibtexEntry(self._store, row, self))
+        return entry
+
+    def _AddRecords(self, path, records):
+        with self._entries_lock:
+            # Entries of a reloaded file replace those loaded before.
+            for row in self._file_rows.pop(path, ()):
+                self._store.Remove(row)
+
+            rows = [self._store.Append(path, record) for record in records]
+            for row in rows:
+                self._index.Add(row, self._store.Grams(row))
+            self._file_rows[path] = array.array('I', rows)
+
+            if self.loading_done.is_set():
+                self._generation += 1
+                self.last_search = None
+            live_search = self._live_search
+
+        if live_search is None:
             return
 
+        # Ranked results are ranked again with the new entries; unranked
+        # ones are only ever appended to.
+        keywords, serial = live_search
+        if self.top_k:
+            if any(self._store.Match(row, keywords) for row in rows):
+                self.Refresh()
+            return
+
+        matched = [self.Entry(row) for row in rows if self._store.Match(row, keywords)]
+        if matched:
+            self.Emit(matched, serial)
+            self.Redraw()
+
+    def SearchingThreadMain(self, search_text, token):
+        stripped = search_text.strip()
         keywords = search_text.split()
-        for entry in self.bib_entries:
-            if entry.Match(keywords):
-                yield entry
+
+        with self._entries_lock:
+            if not self.loading_done.is_set():
+                self._live_search = (keywords, self.searching_serial) if stripped else None
+
+            if not stripped:
+                return
+
+            complete = self.loading_done.is_set()
+            generation = self._generation
+            store = self._store
+            last_search = self.last_search
+            if last_search is not None and BibRepo.Refines(keywords, last_search[0]):
+                candidates = last_search[1]
+            else:
+                candidates = self._index.Candidates(keywords)
+
+        hits = array.array('I')
+        if self.top_k:
+            if not self._RankCandidates(store, candidates, keywords, token, hits):
+                return
+        else:
+            for i, row in enumerate(candidates):
+                if i % SearchToken.CHUNK == 0 and token.Checkpoint(i):
+                    return
+
+                if store.Match(row, keywords):
+                    hits.append(row)
+                    token.work = i + 1
+                    yield self.Entry(row, store)
+
+        token.work = len(candidates)
+        token.hits = len(hits)
+
+        # Only a search that saw every entry and ran to the end can seed the
+        # next refinement.
+        with self._entries_lock:
+            if complete and generation == self._generation:
+                self.last_search = (keywords, hits)
+
+    def _RankCandidates(self, store, candidates, keywords, token, hits):
+        """Shows the top_k matches by relevance; False if the search was cancelled.
+
+        Matches go through a bounded min-heap, so only top_k entries ever
+        reach the results panel: a partial ranking once the search has run
+        for EMIT_INTERVAL, and the final one when it is done.
+        """
+        scorer = RelevanceScorer(keywords)
+        top_k = min(self.top_k, token.limit) if token.limit else self.top_k
+        heap = []
+        partial_emitted = False
+
+        for i, row in enumerate(candidates):
+            if i % SearchToken.CHUNK == 0:
+                if token.Checkpoint(i):
+                    return False
+
+                if not partial_emitted and heap and \
+                   time.time() - token.start_time >= BibRepo.EMIT_INTERVAL:
+                    token.EmitRanked(self._Ranked(store, heap))
+                    partial_emitted = True
+
+            if not store.Match(row, keywords):
+                continue
+
+            hits.append(row)
+            item = (scorer.Score(store, row), -row)
+            if len(heap) < top_k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+        token.EmitRanked(self._Ranked(store, heap))
+        return True
+
+    def _Ranked(self, store, heap):
+        return [self.Entry(-neg_row, store) for _, neg_row in sorted(heap, reverse=True)]
 
 class OutputBibtexRepo(BibtexRepo):
-    def __init__(self, glob_expr, event_loop, enabled):
-        super().__init__(glob_expr, event_loop, enabled)
+    """The bib file that selected entries are written to.
+
+    Writing only adds the entries it does not have yet: the bytes already in
+    the file are kept unchanged rather than reformatted. They are still read,
+    scanned for keys and copied on every write, so a write takes time
+    proportional to the size of the file.
+    """
+
+    # Key of every entry in a bib file, and the command it comes with.
+    _ENTRY_KEY = re.compile(rb"@\s*([A-Za-z]+)\s*[{(]\s*([^\s,]+)\s*,")
+
+    def __init__(self, glob_expr, redraw_scheduler, enabled, config=None):
+        super().__init__(glob_expr, redraw_scheduler, enabled, config)
         self.selected_keys_panel = None
 
         if len(self.bib_files) > 1:
@@ -694,44 +2435,652 @@ class OutputBibtexRepo(BibtexRepo):
         self.access_type = 'rw'
         self.output_file = self.bib_files[0] if self.bib_files else glob_expr
 
-    def Write(self):
-        if self.selected_keys_panel is None:
-            return
+        # Keys of selected entries the last Write left out, because the file
+        # or another selected entry already has a different entry under them.
+        self.collisions = []
+
+    def Write(self, resolved=None):
+        """Appends the selected entries missing from the file; returns their keys.
+
+        resolved holds (entry, pybtex entry) pairs of the selected entries to
+        write, as resolved by SelectionWriter. Without it, the entries
+        selected now are written, each asked for its own pybtex entry.
+
+        The file is rewritten next to itself, synced and renamed over the
+        old one, so that a crash leaves either the old or the new file.
+        """
+        if resolved is None:
+            if self.selected_keys_panel is None:
+                return []
+
+            resolved = []
+            for entry in list(self.selected_keys_panel.entries.values()):
+                try:
+                    resolved.append((entry, entry.pyb_entry))
+                except Exception as e:
+                    logging.error(f"Could not get entry {entry.bibkey}: {e}. Not writing it to file.")
 
         self.loading_done.wait()
 
-        entries = {e.bibkey: e.pyb_entry for e in self.bib_entries}
-        entries.update({e.bibkey: e.pyb_entry for e in self.selected_keys_panel.entries.values()})
+        # The file itself, not what was loaded, may have changed since.
+        path = os.path.realpath(self.output_file)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+
+        present = {key.decode('utf-8', 'replace').lower()
+                   for command, key in OutputBibtexRepo._ENTRY_KEY.findall(data)
+                   if command.lower() not in (b"comment", b"string", b"preamble")}
+        with self._entries_lock:
+            loaded = {self._store.bibkeys[row].lower(): row
+                      for row in self._file_rows.get(self.output_file, ())
+                      if not self._store.dead[row]}
+
+        new_entries = {}
+        records = []
+        self.collisions = []
+        for entry, pyb_entry in resolved:
+            if entry.repo is self:
+                continue
+
+            key = entry.bibkey
+            if pyb_entry is None:
+                logging.error(f"Key {key} has empty entry. Not writing it to file.")
+                continue
+            record = BibRecord.FromPybtex(key, pyb_entry)
+
+            folded = key.lower()
+            if folded in present:
+                row = loaded.get(folded)
+                if row is None or not OutputBibtexRepo._SameEntry(record, self._store.Record(row)):
+                    self.collisions.append(key)
+                continue
+            if any(folded == k.lower() for k in new_entries):
+                self.collisions.append(key)
+                continue
+
+            new_entries[key] = pyb_entry
+            records.append(record)
+
+        for key in self.collisions:
+            logging.warning(f"Not writing key {key}: file '{self.output_file}' "
+                            f"or another selection already has a different entry under it")
+        if self.collisions and self.message_bar is not None:
+            self.message_bar.Post(f"Not written, keys taken by other entries: "
+                                  f"{', '.join(self.collisions)}.", 'error')
 
-        for key, entry in entries.items():
-            if entry is None:
-                logging.error(f"Key {key} has empty entry. Not writing to file.")
+        if not new_entries:
+            return []
+
+        import pybtex.database
+        text = pybtex.database.BibliographyData(new_entries).to_string('bibtex')
+        if data and not data.endswith(b"\n"):
+            data += b"\n"
+        self._Commit(path, data + (b"\n" if data else b"") + text.encode('utf-8'))
+        self._AppendRecords(records)
+
+        logging.info(f"Appended {len(new_entries)} entries to file '{self.output_file}'")
+        return list(new_entries)
+
+    @staticmethod
+    def _SameEntry(a, b):
+        """Whether two records hold the same entry, in whatever field order."""
+        def Folded(record):
+            _, entry_type, fields, persons = record[:4]
+            return (entry_type.lower(),
+                    {name.lower(): value for name, value in fields},
+                    {role.lower(): people for role, people in persons})
+        return Folded(a) == Folded(b)
+
+    @staticmethod
+    def _Commit(path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+        except BaseException:
+            try: os.unlink(tmp_path)
+            except FileNotFoundError: pass
+            raise
+
+        # Make the rename itself durable.
+        directory = os.open(os.path.dirname(path), os.O_RDONLY)
+        try: os.fsync(directory)
+        finally: os.close(directory)
+
+    def _AppendRecords(self, records):
+        """Adds the entries just appended to the file, without reloading it."""
+        with self._entries_lock:
+            rows = [self._store.Append(self.output_file, record) for record in records]
+            for row in rows:
+                self._index.Add(row, self._store.Grams(row))
+            self._file_rows.setdefault(self.output_file, array.array('I')).extend(rows)
+            self._file_stats[self.output_file] = BibtexRepo._Stat(self.output_file)
+            self._generation += 1
+            self.last_search = None
+
+class IndexedBibtexRepo(BibtexRepo):
+    """Searches a prebuilt BibIndex (see --build-index) in place of bib files."""
+
+    def LoadingThreadMain(self):
+        logging.debug(f"Opening index '{self.source}'")
+
+        index = self._OpenIndex()
+        if index is None:
+            return 'no file'
+
+        self._SwapIndex(index)
+        self.searchable.set()
+
+        if self.config.get('watch', False):
+            self._StartWatching()
+
+        return 'ready'
+
+    def _OpenIndex(self):
+        try:
+            return BibIndex(self.source)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not open index '{self.source}': {e}")
+            if self.message_bar is not None:
+                self.message_bar.Post(f"Could not open index '{self.source}'.", 'warning')
+            return None
+
+    def _SwapIndex(self, index):
+        with self._entries_lock:
+            self._store = self._index = index
+            self._views = {}
+            self._file_stats = {self.source: BibtexRepo._Stat(self.source)}
+            self._generation += 1
+            self.last_search = None
+        logging.debug(f"Opened index '{self.source}' of {len(index)} entries")
+
+    def _Rescan(self):
+        # A rebuilt index replaces the file, so reopen it when it changes.
+        if BibtexRepo._Stat(self.source) in (None, self._file_stats.get(self.source)):
+            return
+
+        index = self._OpenIndex()
+        if index is None:
+            return
+
+        self._SwapIndex(index)
+        if self.message_bar is not None:
+            self.message_bar.Post(f"Reopened index '{self.source}'.", 'normal', 1)
+        self.Refresh()
+
+class DblpResponseCache:
+    """On-disk cache of DBLP search responses.
+
+    Responses are keyed by the normalized query and kept as zlib-compressed
+    pickles, one file per query. Entries older than the TTL are still served
+    but reported as stale. Once the cache outgrows its size bound, the least
+    recently used files are evicted (a hit bumps the file's mtime).
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir=None, ttl=7 * 24 * 3600, max_bytes=64 << 20):
+        if cache_dir is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser("~/.cache")
+            cache_dir = os.path.join(base, "bibrarian", "dblp")
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def Normalize(query):
+        return ' '.join(query.lower().split())
+
+    def Get(self, query):
+        """Returns (body, fresh) for the query, or None on a miss."""
+        query = DblpResponseCache.Normalize(query)
+        path = self._CachePath(query)
+        try:
+            with open(path, 'rb') as f:
+                cached = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Discarding unreadable cached response for '{query}': {e}")
+            return None
+
+        if cached.get('version') != DblpResponseCache.VERSION or cached.get('query') != query:
+            return None
+
+        return cached['body'], time.time() - cached['time'] < self.ttl
+
+    def Put(self, query, body):
+        query = DblpResponseCache.Normalize(query)
+        cached = {'version': DblpResponseCache.VERSION,
+                  'query': query,
+                  'time': time.time(),
+                  'body': body}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._CachePath(query)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(cached, pickle.HIGHEST_PROTOCOL)))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Could not cache response for '{query}': {e}")
+            return
+
+        self._Evict()
+
+    def _Evict(self):
+        with self._lock:
+            try:
+                files = [(e.stat().st_mtime, e.stat().st_size, e.path)
+                         for e in os.scandir(self.cache_dir) if e.name.endswith('.pickle.z')]
+            except OSError:
                 return
 
-        pybtex.database.BibliographyData(entries).to_file(self.output_file)
-        logging.info(f"Wrote to file '{self.output_file}'")
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes: break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def _CachePath(self, query):
+        digest = hashlib.sha1(query.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.v{DblpResponseCache.VERSION}.pickle.z")
+
+class BibtexStore:
+    """Content-addressed on-disk store of bibtex records fetched from DBLP.
+
+    Record texts live under objects/ named by their sha1, and refs/ maps
+    each DBLP key to the object holding its record. Files are written by
+    atomic renames, so several processes can share one store.
+    """
+
+    def __init__(self, store_dir=None):
+        if store_dir is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser("~/.cache")
+            store_dir = os.path.join(base, "bibrarian", "dblp-bibtex")
+        self.store_dir = store_dir
+
+    def Get(self, key):
+        try:
+            with open(self._RefPath(key), encoding='utf-8') as f:
+                digest, stored_key = f.read().rstrip('\n').split(' ', 1)
+            if stored_key != key:
+                return None
+
+            with open(self._ObjectPath(digest), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Discarding unreadable stored bibtex of {key}: {e}")
+            return None
+
+        if hashlib.sha1(data).hexdigest() != digest:
+            logging.warning(f"Stored bibtex of {key} is corrupted")
+            return None
+
+        return data.decode('utf-8')
+
+    def Put(self, key, bib_text):
+        data = bib_text.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        try:
+            object_path = self._ObjectPath(digest)
+            if not os.path.exists(object_path):
+                BibtexStore._WriteAtomically(object_path, data)
+            BibtexStore._WriteAtomically(self._RefPath(key), f"{digest} {key}\n".encode('utf-8'))
+        except Exception as e:
+            logging.warning(f"Could not store bibtex of {key}: {e}")
+
+    def Keys(self):
+        refs_dir = os.path.join(self.store_dir, "refs")
+        for path in glob.glob(os.path.join(refs_dir, "*", "*")):
+            if path.endswith('.tmp'): continue
+            with open(path, encoding='utf-8') as f:
+                yield f.read().rstrip('\n').split(' ', 1)[1]
+
+    def Export(self, file_name):
+        """Writes every stored record to a JSON-lines file; returns the count."""
+        count = 0
+        with open(file_name, 'w', encoding='utf-8') as f:
+            for key in sorted(self.Keys()):
+                bib_text = self.Get(key)
+                if bib_text is None: continue
+                print(json.dumps({'key': key, 'bibtex': bib_text}), file=f)
+                count += 1
+        return count
+
+    def Import(self, file_name):
+        """Stores the records of a file written by Export; returns the count."""
+        count = 0
+        with open(file_name, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip(): continue
+                record = json.loads(line)
+                self.Put(record['key'], record['bibtex'])
+                count += 1
+        return count
+
+    def _RefPath(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.store_dir, "refs", digest[:2], digest[2:])
+
+    def _ObjectPath(self, digest):
+        return os.path.join(self.store_dir, "objects", digest[:2], digest[2:])
+
+    @staticmethod
+    def _WriteAtomically(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+class HttpConnectionPool:
+    """Persistent HTTP(S) connections, one per host and thread.
+
+    Each fetching thread reuses its keep-alive connection to a host across
+    requests instead of paying a new TCP and TLS handshake every time.
+    """
+
+    MAX_REDIRECTS = 5
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def Get(self, url, timeout=None):
+        import urllib.error
+        import urllib.parse
+        for _ in range(HttpConnectionPool.MAX_REDIRECTS + 1):
+            response, body = self._Request(url, timeout)
+            if response.status in (301, 302, 303, 307, 308):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+
+            if response.status != 200:
+                raise urllib.error.HTTPError(url, response.status, response.reason,
+                                             response.headers, None)
+            return body
+
+        raise urllib.error.URLError(f"Too many redirects when fetching {url}")
+
+    def _Request(self, url, timeout):
+        import http.client
+        import urllib.parse
+        parts = urllib.parse.urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        connections = self._local.connections
+
+        # A kept-alive connection may have been dropped by the server since
+        # its last use; retry once on a fresh one.
+        for retry in (False, True):
+            connection = connections.get(host)
+            if connection is None:
+                ctor = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+                connection = connections[host] = ctor(parts.netloc, timeout=timeout)
+
+            try:
+                connection.request('GET', path, headers={'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                del connections[host]
+                if retry: raise
+
+class BibtexFetcher:
+    """Bounded pool of threads fetching bibtex records of remote entries.
+
+    Besides fetches for selected entries, it runs speculative prefetches on
+    a separate low-priority queue. At most prefetch_workers of them run at a
+    time, none starts while selections are waiting, and a prefetch whose
+    search has been superseded is dropped before it starts. A prefetch that
+    a selection waits for (see WaitPrefetch) starts without waiting. Without
+    prefetch workers, prefetches are ignored.
+    """
+
+    PREFETCH_BACKOFF = 0.05
+
+    def __init__(self, workers, on_change=None, prefetch_workers=0):
+        self.connections = HttpConnectionPool()
+        self.on_change = on_change
+
+        self.queued = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="bibtex")
+
+        self.prefetched = 0
+        self.prefetches_dropped = 0
+        self._prefetch_queue = collections.deque()
+        self._prefetching = {}
+        self._prefetch_wanted = set()
+        self._prefetch_ready = threading.Condition()
+
+        self.prefetch_workers = prefetch_workers
+        for i in range(prefetch_workers):
+            threading.Thread(name=f"prefetch-{i}", target=self._PrefetchThreadMain,
+                             daemon=True).start()
+
+    def Submit(self, fn):
+        with self._lock:
+            self.queued += 1
+        self._Notify()
+        return self._executor.submit(self._Run, fn)
+
+    def _Run(self, fn):
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+        self._Notify()
+
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._Notify()
+
+    def Prefetch(self, key, fn, token):
+        if not self.prefetch_workers:
+            return
+
+        with self._prefetch_ready:
+            self._prefetch_queue.append((key, fn, token))
+            self._prefetch_ready.notify()
+
+    def WaitPrefetch(self, key):
+        with self._prefetch_ready:
+            future = self._prefetching.get(key)
+            if future is None:
+                return
+            # The waiting selection itself counts as queued, and a prefetch
+            # backing off for it would never start.
+            self._prefetch_wanted.add(key)
+
+        try:
+            concurrent.futures.wait([future])
+        finally:
+            with self._prefetch_ready:
+                self._prefetch_wanted.discard(key)
+
+    def _PrefetchThreadMain(self):
+        while True:
+            with self._prefetch_ready:
+                self._prefetch_ready.wait_for(lambda: self._prefetch_queue)
+                key, fn, token = self._prefetch_queue.popleft()
+                if token.cancelled or key in self._prefetching:
+                    self.prefetches_dropped += 1
+                    continue
+                future = self._prefetching[key] = concurrent.futures.Future()
+
+            while self.queued and not token.cancelled and key not in self._prefetch_wanted:
+                time.sleep(BibtexFetcher.PREFETCH_BACKOFF)
+
+            try:
+                if not token.cancelled:
+                    fn()
+                    self.prefetched += 1
+                else:
+                    self.prefetches_dropped += 1
+            except Exception as e:
+                logging.debug(f"Prefetch of {key} failed: {e}")
+            finally:
+                with self._prefetch_ready:
+                    del self._prefetching[key]
+                future.set_result(None)
+
+    def _Notify(self):
+        if self.on_change is not None:
+            self.on_change(self)
 
 class DblpRepo(BibRepo):
-    def __init__(self, event_loop, enabled):
-        super().__init__("https://dblp.org", event_loop, enabled)
+    READ_CHUNK = 16384
+
+    def __init__(self, redraw_scheduler, enabled, config=None):
+        self.config = config if config is not None else {}
+
+        remote = self.config.get('remote', "dblp.org")
+        self.base_url = (remote if '://' in remote else f"https://{remote}").rstrip('/')
+
+        # Seconds a query has to stay unchanged before it is sent, and the
+        # timeout of each request.
+        self.debounce = self.config.get('debounce', 0.3)
+        self.timeout = self.config.get('timeout', 10)
+
+        # In offline mode only cached responses are shown.
+        self.offline = self.config.get('offline', False)
+        if self.config.get('cache', True):
+            self._response_cache = DblpResponseCache(
+                    ttl=self.config.get('cache_ttl', 7 * 24 * 3600),
+                    max_bytes=self.config.get('cache_size', 64 << 20))
+        else:
+            self._response_cache = None
+
+        # Opt-in speculative fetching of the bibtex of the first "prefetch"
+        # hits and of hits within "prefetch_nearby" rows of the focus.
+        self.prefetch = self.config.get('prefetch', 0)
+        self.prefetch_nearby = self.config.get('prefetch_nearby', 0)
+        self.selection_latencies = collections.deque(maxlen=256)
+
+        self.fetcher = BibtexFetcher(self.config.get('fetch_workers', 4), self._OnFetcherChange,
+                                     self.config.get('prefetch_workers', 2)
+                                     if self.prefetch or self.prefetch_nearby else 0)
+        self.bibtex_store = BibtexStore()
+
+        super().__init__(self.base_url, redraw_scheduler, enabled)
 
     def LoadingThreadMain(self):
         return 'ready'
 
-    def SearchingThreadMain(self, search_text):
+    def SearchingThreadMain(self, search_text, token):
         stripped = search_text.strip()
         if not stripped:
             return
 
-        url = f"https://dblp.org/search/publ/api?q={urllib.parse.quote(search_text)}&format=json"
-        with urllib.request.urlopen(url) as response:
-            bib_data = json.load(response)
+        cached = self._response_cache.Get(stripped) if self._response_cache is not None else None
+        if cached is not None:
+            body, fresh = cached
+            yield from self._ParseResponse(body, token)
+
+            # Stale results stay on screen while they are refreshed for next
+            # time, in the background so that this search ends right away.
+            if not fresh and not self.offline:
+                threading.Thread(name=f"revalidate-{self.source}", target=self._Revalidate,
+                                 args=(stripped, SearchToken(self, token.serial)),
+                                 daemon=True).start()
+            return
 
-            if 'hit' not in bib_data['result']['hits']:
-                return []
+        if self.offline:
+            return
 
-            for entry in bib_data['result']['hits']['hit']:
-                yield DblpEntry(entry, self)
+        body = self._FetchResponse(stripped, token)
+        if body is not None:
+            yield from self._ParseResponse(body, token)
+
+    def _Revalidate(self, query, token):
+        try:
+            self._FetchResponse(query, token)
+        except Exception as e:
+            logging.warning(f"Could not refresh the cached response to '{query}': {e}")
+
+    def _FetchResponse(self, query, token):
+        """Fetches the response to the query, or returns None if it went stale."""
+        if token.Wait(self.debounce):
+            token.aborted = True
+            return None
+
+        import urllib.parse
+        import urllib.request
+        url = f"{self.base_url}/search/publ/api?q={urllib.parse.quote(query)}&format=json"
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            chunks = []
+            received = 0
+            while True:
+                chunk = response.read(DblpRepo.READ_CHUNK)
+                if not chunk: break
+                chunks.append(chunk)
+                received += len(chunk)
+                self.stats.AddBytes(len(chunk))
+                if token.Checkpoint(received):
+                    return None
+
+        body = b''.join(chunks)
+        if self._response_cache is not None:
+            self._response_cache.Put(query, body)
+        return body
+
+    def RecordSelectionLatency(self, seconds):
+        self.selection_latencies.append(seconds)
+        logging.debug(f"Bibtex ready {seconds * 1000:.1f} ms after selection")
+
+    def StatsObject(self):
+        stats = super().StatsObject()
+        stats['p95_selection_seconds'] = RepoStats.Percentile(self.selection_latencies, 0.95)
+        return stats
+
+    def _OnFetcherChange(self, fetcher):
+        with self.redraw_lock:
+            if fetcher.queued or fetcher.in_flight:
+                self.status_indicator_widget.info.set_text(
+                        ('db_fetch', f"fetch {fetcher.in_flight}+{fetcher.queued}"))
+            else:
+                self.status_indicator_widget.info.set_text("")
+        self.UpdateCounters()
+        self.Redraw()
+
+    def _ParseResponse(self, body, token):
+        bib_data = json.loads(body)
+        if 'hit' not in bib_data['result']['hits']:
+            return
+
+        token.hits = len(bib_data['result']['hits']['hit'])
+        for rank, entry in enumerate(bib_data['result']['hits']['hit']):
+            entry = DblpEntry(entry, self)
+            if rank < self.prefetch:
+                entry.Prefetch(token)
+            yield entry
 
 class Banner(urwid.AttrMap):
     def __init__(self):
@@ -749,13 +3098,90 @@ class Banner(urwid.AttrMap):
                 urwid.Pile([self.big_text_clipped, self.subtitle, self.version]),
                 'middle')
 
+class WidgetCache:
+    """Bounded LRU of entries currently holding a search panel widget."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = collections.OrderedDict()
+
+    def Get(self, entry):
+        key = id(entry)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        else:
+            self._entries[key] = entry
+            while len(self._entries) > self.capacity:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.ReleaseSearchPanelWidget()
+
+        return entry.search_panel_widget
+
+class LazyEntryWalker(urwid.ListWalker):
+    """List walker over entries that builds row widgets only when shown.
+
+    ListBox only asks for the rows around its visible window, so however
+    many entries there are, only those rows ever get widgets, and the
+    shared WidgetCache bounds how many are kept around.
+    """
+
+    def __init__(self, entries, widget_cache):
+        self.entries = entries
+        self.focus = 0 if entries else None
+        self._widget_cache = widget_cache
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, position):
+        return self._widget_cache.Get(self.entries[position])
+
+    def extend(self, entries):
+        self.entries.extend(entries)
+        if self.focus is None:
+            self.focus = 0
+        self._modified()
+
+    def get_focus(self):
+        if self.focus is None:
+            return None, None
+        return self[self.focus], self.focus
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        if position + 1 >= len(self.entries):
+            return None, None
+        return self[position + 1], position + 1
+
+    def get_prev(self, position):
+        if position <= 0:
+            return None, None
+        return self[position - 1], position - 1
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self.entries) - 1, -1, -1)
+        return range(len(self.entries))
+
 class SearchResultsPanel(urwid.AttrMap):
+    # Rows around the focus whose entries are told about it, see OnNearFocus.
+    NEAR_FOCUS = 5
+
+    # Row widgets kept alive for scrolling back and forth; all others are
+    # rebuilt on demand.
+    WIDGET_CACHE_SIZE = 512
+
     def __init__(self):
         super().__init__(urwid.SolidFill(), None)
         self._serial = 0
         self._serial_lock = threading.Lock()
 
         self.banner = Banner()
+        self.list_walker = None
+        self._widget_cache = WidgetCache(SearchResultsPanel.WIDGET_CACHE_SIZE)
 
         self._Clear()
 
@@ -774,21 +3200,62 @@ class SearchResultsPanel(urwid.AttrMap):
         self.SyncDisplay()
 
     def Add(self, entry, serial):
+        self.AddBatch([entry], serial)
+
+    def AddBatch(self, entries, serial):
+        """Appends entries in place, keeping the focus where it is."""
         with self._serial_lock:
-            if self._serial == serial:
-                self.items.append(entry.search_panel_widget)
+            if self._serial != serial:
+                return
+
+            self.items.extend(entries)
+
+            enabled_entries = [e for e in entries if e.repo.enabled]
+            if not enabled_entries:
+                return
+
+            if self.list_walker is None:
                 self.SyncDisplay()
+            else:
+                self.list_walker.extend(enabled_entries)
+
+    def ReplaceRepoResults(self, repo, entries, serial):
+        with self._serial_lock:
+            if self._serial != serial:
+                return
+
+            self.items = [e for e in self.items if e.repo is not repo] + entries
+            self.SyncDisplay()
 
     def SyncDisplay(self):
 
-        enabled_items = [item for item in self.items if item.entry.repo.enabled]
+        focus_entry = None
+        if self.list_walker is not None and self.list_walker.focus is not None:
+            focus_entry = self.list_walker.entries[self.list_walker.focus]
+
+        enabled_items = [item for item in self.items if item.repo.enabled]
         if enabled_items:
-            self.list_walker = urwid.SimpleListWalker(enabled_items)
+            self.list_walker = LazyEntryWalker(enabled_items, self._widget_cache)
+            if focus_entry is not None and focus_entry.repo.enabled:
+                try: self.list_walker.set_focus(enabled_items.index(focus_entry))
+                except ValueError: pass
+            urwid.connect_signal(self.list_walker, 'modified', self._OnFocusChanged)
             self.original_widget = urwid.ListBox(self.list_walker)
 
         else:
+            self.list_walker = None
             self.original_widget = self.banner
 
+    def _OnFocusChanged(self):
+        focus = self.list_walker.focus
+        if focus is None:
+            return
+
+        lo = max(0, focus - SearchResultsPanel.NEAR_FOCUS)
+        hi = focus + SearchResultsPanel.NEAR_FOCUS + 1
+        for position, entry in enumerate(self.list_walker.entries[lo:hi], lo):
+            entry.OnNearFocus(abs(position - focus))
+
     def keypress(self, size, key):
         if key in ('ctrl n', 'j'):
             self.original_widget._keypress_down(size)
@@ -826,11 +3293,12 @@ class SelectedKeysPanel(urwid.Pile):
 
         self.contents = new_contents
 
-    def Write(self):
+    def Write(self, entries=None):
         if self.keys_output is None: return
+        if entries is None: entries = list(self.entries.values())
 
         with open(self.keys_output, 'w') as f:
-            print(','.join(map(lambda e: e.bibkey, self.entries.values())),
+            print(','.join(map(lambda e: e.bibkey, entries)),
                   file=f, end='')
 
             logging.info(f"Wrote selected keys to file '{self.keys_output}'")
@@ -860,16 +3328,14 @@ class SearchBar(urwid.AttrMap):
         self._search_serial += 1
 
 class MessageBar(urwid.AttrMap):
-    def __init__(self, loop):
+    def __init__(self, redraw_scheduler):
         super().__init__(urwid.Text("Welcome to bibrarian."), 'msg_normal')
 
-        self.event_loop = loop
-        self._redraw_fd = loop.watch_pipe(self._FdWriteHandler)
+        self.redraw_scheduler = redraw_scheduler
 
         self.initial_delay = 1
         self.post_delay = 3
         self.tips_delay = 5
-        self.next_message_ready = threading.Event()
 
         self.next_message_scheduled = 0
 
@@ -887,11 +3353,7 @@ class MessageBar(urwid.AttrMap):
         self.periodic_trigger_thread = threading.Thread(
                 name=f"msg-trigger", target=self._PeriodicTrigger, daemon=True)
 
-        self.message_update_thread = threading.Thread(
-                name=f"msg-update", target=self._UpdateMessage, daemon=True)
-
         self.periodic_trigger_thread.start()
-        self.message_update_thread.start()
 
     def Post(self, message, severity='normal', delay=None):
         if severity == 'normal':
@@ -908,14 +3370,11 @@ class MessageBar(urwid.AttrMap):
 
         with self.msg_lock:
             self.original_widget = urwid.Text((style, f"{label}: {message}"))
-            self.next_message_ready.set()
+            self.redraw_scheduler.Request()
 
             if delay is None: delay = self.post_delay
             self.next_message_scheduled = time.time() + delay
 
-    def _FdWriteHandler(self, data):
-        self.event_loop.draw_screen()
-
     def _PeriodicTrigger(self):
         time.sleep(self.initial_delay)
         while True:
@@ -924,7 +3383,7 @@ class MessageBar(urwid.AttrMap):
                     if time.time() >= self.next_message_scheduled:
                         with self.msg_lock:
                             self.original_widget = urwid.Text(('msg_tips', f"Tip: {message}"))
-                            self.next_message_ready.set()
+                            self.redraw_scheduler.Request()
                             self.next_message_scheduled = time.time() + self.tips_delay
                         time.sleep(self.tips_delay)
                         break
@@ -932,20 +3391,145 @@ class MessageBar(urwid.AttrMap):
                         time.sleep(1)
                         continue
 
-    def _UpdateMessage(self):
-        while True:
-            self.next_message_ready.wait()
-            self.next_message_ready.clear()
-            os.write(self._redraw_fd, b"?")
-
-    def __del__(self):
-        os.close(self._redraw_fd)
-
 class DetailsPanel(urwid.AttrMap):
     def __init__(self):
         super().__init__(urwid.Filler(urwid.Text(
             ('details_hint', 'Hit <i> on highlighted item to update info.')), 'top'), None)
 
+class SelectionWriter:
+    """Writes the selected entries out on ctrl+w, without blocking the UI.
+
+    The full entries are resolved in parallel, fetches of remote ones
+    included, with progress in the message bar. Whatever resolved by the
+    deadline is written; entries that failed are retried until then, and
+    those still missing stay selected, so that another ctrl+w retries them.
+    The program exits once every selected entry made it.
+
+    What is written is the selection as it was on ctrl+w; entries selected
+    while writing wait for the next ctrl+w.
+    """
+
+    DEADLINE = 15
+    WORKERS = 8
+    RETRIES = 2
+    RETRY_DELAY = 1
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.failed = []
+        self._thread = None
+
+    def Start(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.widget.message_bar.Post("Still writing the selected entries.", 'warning')
+            return
+
+        # Taken on the UI thread, which is the one changing the selection.
+        entries = list(self.widget.selected_keys_panel.entries.values())
+        self._thread = threading.Thread(name="write", target=self._ThreadMain, args=(entries,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _ThreadMain(self, entries):
+        message_bar = self.widget.message_bar
+
+        def OnProgress(done, total):
+            message_bar.Post(f"Resolving selected entries: {done}/{total}.", 'normal')
+
+        resolved, self.failed = SelectionWriter.Resolve(entries, SelectionWriter.DEADLINE,
+                                                        OnProgress)
+
+        written = 0
+        try:
+            for repo in self.widget.output_repos:
+                written += len(repo.Write(resolved))
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            message_bar.Post(f"Could not write the selected entries: {e}", 'error', 10)
+            return
+
+        if self.failed:
+            keys = ', '.join(entry.bibkey for entry in self.failed)
+            logging.error(f"Could not get selected entries {keys} by the deadline")
+            message_bar.Post(f"Wrote {written} entries, but could not get {keys}. "
+                             f"Hit ctrl+w to retry them.", 'error', 10)
+            return
+
+        self.widget.redraw_scheduler.Call(lambda: self._Finish(entries))
+
+    def _Finish(self, entries):
+        """Exits once the selection written is still the selection; on the UI thread."""
+        selected = self.widget.selected_keys_panel.entries
+        written = {entry.unique_key for entry in entries}
+        if any(key not in written for key in selected):
+            self.widget.message_bar.Post("Entries were selected while writing. "
+                                         "Hit ctrl+w to write them too.", 'warning', 10)
+            return
+
+        try: self.widget.selected_keys_panel.Write(entries)
+        except: logging.error(traceback.format_exc())
+
+        raise urwid.ExitMainLoop()
+
+    @staticmethod
+    def Resolve(entries, timeout, on_progress=None):
+        """Gets the pybtex entries of entries, WORKERS at a time.
+
+        Returns the (entry, pybtex entry) pairs resolved within timeout
+        seconds, in the order of entries, and the entries that were not. A
+        worker still waiting on an entry at the deadline is left behind; its
+        result is dropped.
+        """
+        deadline = time.monotonic() + timeout
+        pending = collections.deque((entry, 0) for entry in entries)
+        results = queue.Queue()
+
+        def WorkerMain():
+            while True:
+                try:
+                    entry, attempt = pending.popleft()
+                except IndexError:
+                    return
+
+                time.sleep(SelectionWriter.RETRY_DELAY * attempt)
+                try:
+                    pyb_entry = entry.pyb_entry
+                except Exception:
+                    logging.error(traceback.format_exc())
+                    pyb_entry = None
+                results.put((entry, attempt, pyb_entry))
+
+        def StartWorker():
+            threading.Thread(name="resolve", target=WorkerMain, daemon=True).start()
+
+        for _ in range(min(SelectionWriter.WORKERS, len(entries))):
+            StartWorker()
+
+        pyb_entries = {}
+        done = 0
+        while done < len(entries):
+            try:
+                entry, attempt, pyb_entry = results.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+
+            if pyb_entry is None and attempt < SelectionWriter.RETRIES \
+                    and time.monotonic() < deadline:
+                logging.warning(f"Retrying selected entry {entry.bibkey}")
+                pending.append((entry, attempt + 1))
+                StartWorker()
+                continue
+
+            done += 1
+            if pyb_entry is not None:
+                pyb_entries[entry.unique_key] = pyb_entry
+            if on_progress is not None:
+                on_progress(done, len(entries))
+
+        return ([(entry, pyb_entries[entry.unique_key]) for entry in entries
+                 if entry.unique_key in pyb_entries],
+                [entry for entry in entries if entry.unique_key not in pyb_entries])
+
 class InputFilter:
     def __init__(self):
         self.widget = None
@@ -954,16 +3538,8 @@ class InputFilter:
         if not keys: return keys
 
         if keys[0] == 'ctrl w':
-            try:
-                for repo in self.widget.output_repos:
-                    repo.Write()
-            except:
-                logging.error(traceback.format_exc())
-
-            try: self.widget.selected_keys_panel.Write()
-            except: logging.error(traceback.format_exc())
-
-            raise urwid.ExitMainLoop()
+            self.widget.selection_writer.Start()
+            return
 
         elif self.MaskDatabases(keys[0]):
             self.widget.search_results_panel.SyncDisplay()
@@ -1002,17 +3578,28 @@ class DatabaseStatusPanel(urwid.Pile):
                       + [(urwid.Text(('cfg_src', f"config: {config_source}")), ('pack', None))]
 
 class TopWidget(urwid.Pile):
-    def __init__(self, args, config, event_loop):
+    def __init__(self, args, config, event_loop, daemon_client=None):
         super().__init__([urwid.SolidFill()])
 
-        self.message_bar = MessageBar(event_loop)
+        self.redraw_scheduler = RedrawScheduler(event_loop, config.get('redraw_interval', 1 / 30))
+
+        self.message_bar = MessageBar(self.redraw_scheduler)
         self.search_results_panel = SearchResultsPanel()
         self.details_panel = DetailsPanel()
         self.selected_keys_panel = SelectedKeysPanel(args.keys_output)
 
-        self.output_repos = [BibRepo.Create(cfg, 'rw', event_loop) for cfg in config['rw_repos']]
+        self.output_repos = [BibRepo.Create(cfg, 'rw', self.redraw_scheduler) for cfg in config['rw_repos']]
 
-        self.bib_repos = [BibRepo.Create(cfg, 'ro', event_loop) for cfg in config['ro_repos']] + self.output_repos
+        # A running daemon already has the bib files and indexes loaded. The
+        # output repos stay local, since they are written from here.
+        self.bib_repos = []
+        for number, cfg in enumerate(config['ro_repos'], 1):
+            if daemon_client is not None and 'remote' not in cfg:
+                self.bib_repos.append(DaemonRepo(daemon_client, number, cfg, self.redraw_scheduler,
+                                                 cfg.get('enabled', True)))
+            else:
+                self.bib_repos.append(BibRepo.Create(cfg, 'ro', self.redraw_scheduler))
+        self.bib_repos += self.output_repos
 
         for repo, i in zip(self.bib_repos, itertools.count(1)):
             repo.short_label = f"{i}"
@@ -1032,6 +3619,8 @@ class TopWidget(urwid.Pile):
         for repo in self.output_repos:
             repo.selected_keys_panel = self.selected_keys_panel
 
+        self.selection_writer = SelectionWriter(self)
+
         self.right_panel = urwid.Pile([
             ('pack', urwid.LineBox(self.db_status_panel, title="Database Info")),
             ('weight', 5, urwid.LineBox(self.details_panel, title="Detailed Info")),
@@ -1045,95 +3634,377 @@ class TopWidget(urwid.Pile):
                          (self.main_widget, ('weight', 1)),
                          (self.message_bar, ('pack', None))]
 
-class DefaultConfig(dict):
-    def __init__(self):
-        self['ro_repos'] = [
-            {
-                'remote': "dblp.org",
-                'enabled': True
-            },
-            {
-                'glob': "/path/to/lots/of/**/*.bib",
-                'enabled': True
-            },
-            {
-                'glob': "/path/to/sample.bib",
-                'enabled': False
-            },
-            {
-                'glob': "/path/to/another/sample.bib"
-            }
-        ]
+class QueryRunner:
+    """Answers one query from a set of repos, without the terminal UI.
+
+    Each repo searches in a thread of its own through its SearchingThreadMain,
+    just like its searching thread does for the UI. Hits are written as JSON
+    lines as soon as a repo yields them, except for repos that rank their
+    hits (BibtexRepo with top_k): those may re-rank while searching, so their
+    final ranking is written once their search is over. Nothing is changed
+    on the repos, so several runners may search the same repos at once.
+    """
+
+    def __init__(self, repos, limit=None, output=sys.stdout, on_hit=None):
+        self.repos = repos
+        self.limit = limit
+        self.output = output
+        self.on_hit = on_hit
+        self.count = 0
+        self.failed = 0
+        self.disconnected = False
+
+        self._output_lock = threading.Lock()
+
+    def Run(self, search_text):
+        threads = [threading.Thread(name=f"query-{repo.source}", target=self._Search,
+                                    args=(repo, search_text), daemon=True)
+                   for repo in self.repos]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        return self.count
+
+    def _Search(self, repo, search_text):
+        repo.loading_done.wait()
+
+        ranked = []
+        token = SearchToken(repo, repo.serial, on_ranked=lambda items: ranked.append(items),
+                            limit=self.limit)
+        written = 0
+        try:
+            for entry in repo.SearchingThreadMain(search_text, token):
+                if self.disconnected or (self.limit and written >= self.limit):
+                    break
+                self._Write(repo, entry)
+                written += 1
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            print(f"bibrarian: searching '{repo.source}' failed: {e}", file=sys.stderr)
+            self.failed += 1
+            return
 
-        self['rw_repos'] = [
-            {
-                'glob': "reference.bib",
-                'enabled': True
-            }
-        ]
+        for entry in (ranked[-1] if ranked else [])[:self.limit or None]:
+            self._Write(repo, entry)
 
-    def Write(self, file):
-        with open(file, 'w') as f:
-            json.dump(self, f, indent=4)
+        if not token.aborted and search_text.strip():
+            repo.stats.RecordSearch(time.time() - token.start_time, token.hits)
 
-class Config(dict):
-    def __init__(self, file_name):
-        prefix = os.getcwd()
-        self.source = None
+    def _Write(self, repo, entry):
+        line = json.dumps(QueryRunner.EntryObject(repo, entry), ensure_ascii=False)
+        with self._output_lock:
+            if self.disconnected:
+                return
+            try:
+                self.output.write(line + "\n")
+                self.output.flush()
+                self.count += 1
+            except OSError:
+                # The reader went away (e.g. a daemon client gave up).
+                self.disconnected = True
+                return
 
-        while True:
-            path = os.path.join(prefix, file_name)
-            if os.path.isfile(path) and os.access(path, os.R_OK):
-                with open(path) as f:
-                    self.update(json.load(f))
-                    self.source = path
-                    break
+        if self.on_hit is not None:
+            self.on_hit(repo, entry)
 
-            if prefix == '/': break
-            prefix = os.path.dirname(prefix)
+    @staticmethod
+    def EntryObject(repo, entry):
+        return {'repo': repo.source,
+                'source': entry.source,
+                'key': entry.bibkey,
+                'title': entry.title,
+                'authors': list(entry.authors),
+                'year': entry.year,
+                'venue': entry.venue,
+                'url': entry.url}
 
-        if self.source is None:
-            print("Did not find any config file.")
-            print("You can generate an example config file using option -g.")
-            print("For more information, please use option -h for help.")
-            sys.exit(1)
+    @staticmethod
+    def SelectRepos(configs, selection=None):
+        """Indices of the repo configs to query.
+
+        The configs are in the order of the UI's repo list, and the selection
+        is a comma-separated list of repo numbers as shown in the UI, or of
+        parts of their glob, index or remote. Without one, every enabled
+        repo is queried.
+        """
+        if not selection:
+            return [i for i, cfg in enumerate(configs) if cfg.get('enabled', True)]
+
+        selected = []
+        for item in filter(None, (item.strip() for item in selection.split(','))):
+            for i, cfg in enumerate(configs):
+                if (item == str(i + 1) or (not item.isdigit() and item in BibRepo.ConfigSource(cfg))) \
+                   and i not in selected:
+                    selected.append(i)
+        return selected
+
+class BibrarianDaemon:
+    """Keeps the repos of a config loaded and answers clients on a Unix socket.
+
+    Clients send one JSON request per connection, on a single line, and get
+    JSON lines back:
+
+      {"op": "ping"}                       -> {"ok": true, "pid": ..., "repos": [...]}
+      {"op": "wait", "repo": N}            -> {"status": ...} once repo N has loaded
+      {"op": "query", "query": "...",
+       "limit": N, "repos": "..."}         -> one line per hit (see QueryRunner),
+                                              then {"done": true, "count": ..., "failed": ...}
+      {"op": "record", "repo": N,
+       "source": "...", "key": "..."}      -> {"record": ...}, the BibRecord of a hit
+      {"op": "shutdown"}                   -> {"ok": true}
+
+    Repos are numbered from 1 in the order of the UI's repo list, and
+    anything that goes wrong is answered with {"error": "..."}.
+    """
+
+    # Hits of recent queries, by repo and unique key, for "record" requests.
+    RECENT_HITS = 65536
+
+    class _Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            daemon = self.server.bibrarian_daemon
+            try:
+                request = json.loads(self.rfile.readline())
+                op = request.get('op')
+                if op == 'query':
+                    daemon.Query(request, self.wfile)
+                else:
+                    handler = {'ping': daemon.Ping,
+                               'wait': daemon.Wait,
+                               'record': daemon.Record,
+                               'shutdown': daemon.Shutdown}.get(op)
+                    if handler is None:
+                        raise ValueError(f"unknown op {op!r}")
+                    self._Reply(handler(request))
+
+                    # Stop only once the reply is out.
+                    if op == 'shutdown':
+                        threading.Thread(target=self.server.shutdown, daemon=True).start()
+            except OSError:
+                pass
+            except Exception as e:
+                logging.error(traceback.format_exc())
+                try: self._Reply({'error': str(e)})
+                except OSError: pass
 
-        self._NormalizePaths()
+        def _Reply(self, response):
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b"\n")
 
-    def _NormalizePaths(self):
-        config_dir = os.path.dirname(os.path.realpath(self.source))
-        for repo_group in (self[k] for k in ('ro_repos', 'rw_repos')):
-            for repo_config in repo_group:
-                if 'glob' in repo_config:
-                    repo_config['glob'] = os.path.expandvars(os.path.expanduser(repo_config['glob']))
+    class _Output:
+        """Text side of the binary socket stream, for QueryRunner."""
 
-                    if not os.path.isabs(repo_config['glob']):
-                        repo_config['glob'] = os.path.join(config_dir, repo_config['glob'])
+        def __init__(self, wfile):
+            self.wfile = wfile
 
+        def write(self, text):
+            self.wfile.write(text.encode('utf-8'))
 
-class ArgParser(argparse.ArgumentParser):
-    def __init__(self):
-        super().__init__(prog="bibrarian")
-
-        self.add_argument("-f", "--config",
-                          help="force configuration file path",
-                          default=".bibrarian_config.json",
-                          action='store'
-                          )
-        self.add_argument("-g", "--gen-config",
-                          help="generate a configuration file",
-                          default=False,
-                          action='store_true')
-        self.add_argument("-l", "--log",
-                          help="force log file path",
-                          default=f"/tmp/{getpass.getuser()}_babrarian.log",
-                          action='store')
-        self.add_argument("-k", "--keys-output",
-                          help="output bib keys file (truncate mode)",
-                          action='store')
-        self.add_argument("-v", "--version",
-                          action='version',
-                          version="%(prog)s 1.0")
+        def flush(self):
+            self.wfile.flush()
+
+    def __init__(self, config):
+        self.config = config
+        self.socket_path = DaemonClient.SocketPath(config.source)
+
+        self._configs = config['ro_repos'] + config['rw_repos']
+        accesses = ['ro'] * len(config['ro_repos']) + ['rw'] * len(config['rw_repos'])
+
+        # Queries come in complete; bib files are watched unless told otherwise.
+        overrides = {'debounce': 0, 'prefetch': 0, 'prefetch_nearby': 0}
+        self.redraw_scheduler = RedrawScheduler(None)
+        self.repos = [BibRepo.Create({'watch': True, **cfg, **overrides}, access,
+                                     self.redraw_scheduler)
+                      for cfg, access in zip(self._configs, accesses)]
+
+        self._recent_hits = collections.OrderedDict()
+        self._recent_hits_lock = threading.Lock()
+        self._server = None
+
+    def Serve(self):
+        directory = os.path.dirname(self.socket_path)
+        try:
+            os.makedirs(os.path.dirname(directory), exist_ok=True)
+            DaemonClient.CheckDirectory(directory, create=True)
+        except OSError as e:
+            print(f"bibrarian: cannot serve on {self.socket_path}: {e}", file=sys.stderr)
+            return False
+
+        # Held for as long as the daemon runs, so that of two daemons started
+        # at once only one binds; the socket of a daemon that died is stale.
+        lock_fd = os.open(f"{self.socket_path}.lock", os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            print(f"bibrarian: a daemon already serves {self.config.source}", file=sys.stderr)
+            return False
+
+        try: os.unlink(self.socket_path)
+        except FileNotFoundError: pass
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, BibrarianDaemon._Handler)
+        self._server.daemon_threads = True
+        self._server.bibrarian_daemon = self
+        logging.info(f"Serving {self.config.source} on {self.socket_path}")
+
+        try: self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            try: os.unlink(self.socket_path)
+            except FileNotFoundError: pass
+            os.close(lock_fd)
+        return True
+
+    def Ping(self, request):
+        return {'ok': True,
+                'pid': os.getpid(),
+                'config': self.config.source,
+                'repos': [{'source': repo.source, 'status': repo.status} for repo in self.repos]}
+
+    def Wait(self, request):
+        repo = self._Repo(request)
+        repo.loading_done.wait()
+        return {'status': repo.status, 'entries': repo.entry_count}
+
+    def Query(self, request, wfile):
+        repos = [self.repos[i] for i in QueryRunner.SelectRepos(self._configs, request.get('repos'))]
+
+        runner = QueryRunner(repos, request.get('limit'), BibrarianDaemon._Output(wfile),
+                             self._RememberHit)
+        runner.Run(request.get('query', ""))
+        if not runner.disconnected:
+            wfile.write(json.dumps({'done': True, 'count': runner.count,
+                                    'failed': runner.failed}).encode('utf-8') + b"\n")
+
+    def _RememberHit(self, repo, entry):
+        with self._recent_hits_lock:
+            self._recent_hits[(repo.source, entry.source, entry.bibkey)] = entry
+            self._recent_hits.move_to_end((repo.source, entry.source, entry.bibkey))
+            while len(self._recent_hits) > BibrarianDaemon.RECENT_HITS:
+                self._recent_hits.popitem(last=False)
+
+    def Record(self, request):
+        repo = self._Repo(request)
+        with self._recent_hits_lock:
+            entry = self._recent_hits.get((repo.source, request['source'], request['key']))
+        if entry is None:
+            raise LookupError(f"no recent hit {request['key']} of repo {repo.source}")
+
+        pyb_entry = entry.pyb_entry
+        if pyb_entry is None:
+            raise LookupError(f"could not load the bibtex of {request['key']}")
+        return {'record': BibRecord.FromPybtex(entry.bibkey, pyb_entry)}
+
+    def Shutdown(self, request):
+        logging.info("Shutting down on request")
+        return {'ok': True}
+
+    def _Repo(self, request):
+        index = int(request['repo'])
+        if not 1 <= index <= len(self.repos):
+            raise IndexError(f"no repo {index}")
+        return self.repos[index - 1]
+
+class DaemonRepo(BibRepo):
+    """Stands in for a repo that a running daemon keeps loaded (see BibrarianDaemon)."""
+
+    def __init__(self, client, number, config, redraw_scheduler, enabled):
+        self.client = client
+        self.number = number
+        self._entry_count = None
+        super().__init__(BibRepo.ConfigSource(config), redraw_scheduler, enabled)
+
+    def LoadingThreadMain(self):
+        try:
+            response = self.client.Call({'op': 'wait', 'repo': self.number}, timeout=None)
+        except (OSError, RuntimeError, ValueError) as e:
+            logging.error(f"Daemon could not load repo '{self.source}': {e}")
+            if self.message_bar is not None:
+                self.message_bar.Post(f"Daemon could not load repo '{self.source}'.", 'error')
+            return 'no file'
+
+        self._entry_count = response.get('entries')
+        self.searchable.set()
+        return response['status']
+
+    @property
+    def entry_count(self):
+        return self._entry_count
+
+    def SearchingThreadMain(self, search_text, token):
+        if not search_text.strip():
+            return
+
+        for line in self.client.Request({'op': 'query', 'query': search_text,
+                                         'repos': str(self.number)}):
+            if token.Checkpoint(token.work + 1):
+                return
+
+            self.stats.AddBytes(len(line))
+            response = json.loads(line)
+            if 'key' in response:
+                token.hits += 1
+                yield DaemonEntry(response, self)
+            elif 'error' in response:
+                raise RuntimeError(response['error'])
+
+    def Record(self, entry):
+        return self.client.Call({'op': 'record', 'repo': self.number,
+                                 'source': entry.source, 'key': entry.bibkey})['record']
+
+class DaemonEntry(BibEntry):
+    """Hit of a DaemonRepo; the full entry is asked of the daemon when needed."""
+
+    __slots__ = ('_hit', '_entry', '_details_widget')
+
+    def __init__(self, hit, repo):
+        super().__init__(hit['source'], repo)
+        self._hit = hit
+        self._entry = None
+        self._details_widget = None
+
+    @property
+    def entry(self):
+        if self._entry is None:
+            try:
+                record = self.repo.Record(self)
+            except (OSError, RuntimeError, ValueError) as e:
+                raise LookupError(f"could not get entry {self.bibkey} from the daemon: {e}") from e
+            _, self._entry = BibRecord.ToPybtex(record)
+        return self._entry
+
+    @property
+    def authors(self):
+        return self._hit['authors']
+
+    @property
+    def title(self):
+        return self._hit['title']
+
+    @property
+    def year(self):
+        return self._hit['year']
+
+    @property
+    def venue(self):
+        return self._hit['venue']
+
+    @property
+    def bibkey(self):
+        return self._hit['key']
+
+    @property
+    def url(self):
+        return self._hit['url']
+
+    @property
+    def pyb_entry(self):
+        return self.entry
+
+    @property
+    def details_widget(self):
+        if self._details_widget is None:
+            self._details_widget = BibtexEntry.DetailsWidgetImpl(self)
+        return self._details_widget
 
 class Palette(list):
     def __init__(self):
@@ -1156,6 +4027,8 @@ class Palette(list):
         self.append(('db_status_error', 'light red', 'default'))
         self.append(('db_rw', 'light magenta', 'default'))
         self.append(('db_ro', 'light green', 'default'))
+        self.append(('db_fetch', 'yellow', 'default'))
+        self.append(('db_stats', 'dark cyan', 'default'))
 
         self.append(('mark_none', 'default', 'dark gray'))
         self.append(('mark_selected', 'light cyan', 'dark gray'))
@@ -1169,6 +4042,7 @@ class Palette(list):
         self.append(('bibkey', 'light green', 'default'))
         self.append(('bibtex_ready', 'dark green', 'default'))
         self.append(('bibtex_fetching', 'yellow', 'default'))
+        self.append(('bibtex_failed', 'light red', 'default'))
 
         self.append(('plain+', 'default', 'dark magenta'))
         self.append(('mark_none+', 'default', 'light magenta'))
@@ -1183,6 +4057,7 @@ class Palette(list):
         self.append(('bibkey+', 'light green', 'dark magenta'))
         self.append(('bibtex_ready+', 'dark green', 'dark magenta'))
         self.append(('bibtex_fetching+', 'yellow', 'dark magenta'))
+        self.append(('bibtex_failed+', 'light red', 'dark magenta'))
 
         self.append(('selected_key', 'light cyan', 'default'))
         self.append(('selected_hint', 'dark cyan', 'default'))
@@ -1195,14 +4070,43 @@ class Palette(list):
 
         self.append(('cfg_src', 'dark gray', 'default'))
 
-if __name__ == '__main__':
-    args = ArgParser().parse_args()
+def Main(args, startup_profile):
+    """Runs whatever the arguments ask for besides what cli.Main does itself."""
+    if args.export_dblp_store:
+        count = BibtexStore().Export(args.export_dblp_store)
+        print(f"Exported {count} bibtex records to file {args.export_dblp_store}")
+        sys.exit(0)
 
-    if args.gen_config:
-        DefaultConfig().Write(args.config)
-        print(f"Wrote default config to file {args.config}")
+    if args.import_dblp_store:
+        count = BibtexStore().Import(args.import_dblp_store)
+        print(f"Imported {count} bibtex records from file {args.import_dblp_store}")
         sys.exit(0)
 
+    if args.build_index:
+        glob_expr, index_path = args.build_index
+        start_time = time.time()
+        count = BibIndex.Build(glob_expr, index_path)
+        print(f"Indexed {count} entries into file {index_path} "
+              f"in {time.time() - start_time:.1f} seconds")
+        sys.exit(0)
+
+    if args.validate_scanner:
+        paths = sorted({p for g in args.validate_scanner for p in glob.glob(g, recursive=True)})
+        failed = 0
+        for path in paths:
+            try:
+                problems = BibScanner.Validate(path)
+            except Exception as e:
+                problems = [f"pybtex could not parse it: {e}"]
+
+            print(f"{path}: {'OK' if not problems else f'{len(problems)} problem(s)'}")
+            for problem in problems[:20]:
+                print(f"    {problem}")
+            failed += bool(problems)
+
+        print(f"Validated {len(paths)} files, {failed} with problems")
+        sys.exit(1 if failed else 0)
+
     logging.basicConfig(filename=args.log,
                         format="[%(asctime)s %(levelname)7s] %(threadName)s: %(message)s",
                         datefmt="%m-%d-%Y %H:%M:%S",
@@ -1210,16 +4114,78 @@ if __name__ == '__main__':
 
     config = Config(args.config)
 
+    if args.daemon:
+        daemon = BibrarianDaemon(config)
+        if not daemon.Serve():
+            sys.exit(1)
+        if args.stats_json:
+            RepoStats.Dump(daemon.repos, args.stats_json)
+        sys.exit(0)
+
+    if args.query is not None:
+        startup_profile.Mark("config")
+        try:
+            # Nobody types ahead here, nor watches the files or the results.
+            overrides = {'debounce': 0, 'watch': False, 'prefetch': 0, 'prefetch_nearby': 0}
+            configs = config['ro_repos'] + config['rw_repos']
+            accesses = ['ro'] * len(config['ro_repos']) + ['rw'] * len(config['rw_repos'])
+            redraw_scheduler = RedrawScheduler(None)
+            repos = [BibRepo.Create(dict(configs[i], **overrides), accesses[i], redraw_scheduler)
+                     for i in QueryRunner.SelectRepos(configs, args.repos)]
+            if not repos:
+                print("bibrarian: no repo to search", file=sys.stderr)
+                sys.exit(1)
+            startup_profile.Mark("repos")
+
+            runner = QueryRunner(repos, args.limit)
+            runner.Run(args.query)
+        except KeyboardInterrupt:
+            sys.exit(130)
+
+        startup_profile.Mark("query")
+        if args.startup_profile:
+            startup_profile.Report()
+        if args.stats_json:
+            RepoStats.Dump(repos, args.stats_json)
+        sys.exit(1 if runner.failed else 0)
+
+    daemon_client = DaemonClient(DaemonClient.SocketPath(config.source))
+    if args.no_daemon or daemon_client.Ping() is None:
+        daemon_client = None
+    startup_profile.Mark("config")
+
     input_filter = InputFilter()
     main_loop = urwid.MainLoop(urwid.SolidFill(),
                                palette=Palette(),
                                input_filter=input_filter)
 
-    top_widget = TopWidget(args, config, main_loop)
+    top_widget = TopWidget(args, config, main_loop, daemon_client)
 
     input_filter.widget = top_widget
     main_loop.widget = top_widget
-
-    try: main_loop.run()
+    startup_profile.Mark("repos")
+
+    try:
+        # Same as main_loop.run(), but knowing when the first frame is out.
+        with main_loop.start():
+            main_loop.draw_screen()
+            startup_profile.Mark("first paint")
+            main_loop.event_loop.run()
     except KeyboardInterrupt:
         sys.exit(0)
+    finally:
+        scheduler = top_widget.redraw_scheduler
+        logging.info(f"Redrew {scheduler.redraws} times for {scheduler.requests} requests "
+                     f"(coalescing ratio {scheduler.coalescing_ratio:.1f})")
+        if args.startup_profile:
+            startup_profile.Report()
+        if args.stats_json:
+            RepoStats.Dump(top_widget.bib_repos, args.stats_json)
+        if top_widget.selection_writer.failed:
+            print(f"Not written, could not get entries: "
+                  f"{', '.join(e.bibkey for e in top_widget.selection_writer.failed)}",
+                  file=sys.stderr)
+        for repo in top_widget.output_repos:
+            if repo.collisions:
+                print(f"Not written to '{repo.output_file}', keys taken by other entries: "
+                      f"{', '.join(repo.collisions)}", file=sys.stderr)